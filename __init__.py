@@ -3,10 +3,16 @@ Card Linker Plugin for Anki
 Allows linking related cards together to solve card fragmentation
 """
 from aqt import mw, gui_hooks
+from anki import hooks
 from aqt.qt import *
+from aqt.operations import QueryOp
 from aqt.utils import showInfo
+import json
 from .components.CardLinker import CardLinker
-from .lang import get_text
+from .components.LinkStatusResolver import LinkStatusResolver
+from .components.PanelCache import PanelCache
+from .lang import get_text, get_language
+from .addon_config import get_config, reload_config
 
 try:
     from PyQt6.QtCore import Qt
@@ -23,7 +29,14 @@ except:
         USER_ROLE = 256
         DIALOG_ACCEPTED = 1
 
+addon_package = mw.addonManager.addonFromModule(__name__)
+mw.addonManager.setWebExports(__name__, r'web/.*\.(css|js)')
+mw.addonManager.setConfigUpdatedAction(__name__, reload_config)
+
 card_linker = CardLinker()
+link_status_resolver = LinkStatusResolver()
+panel_cache = PanelCache()
+panel_generation = 0
 
 def setup_editor_buttons(buttons, editor):
     return card_linker.setup_editor_button(buttons, editor)
@@ -35,73 +48,158 @@ def add_linked_cards_to_review(html, card, context):
         return html
     try:
         note = card.note()
-        linked_cards = card_linker.get_linked_cards(note)
-        if linked_cards:
-            css = '\n            <style>\n            .linked-cards-container {\n                border: 2px solid #2196f3;\n                border-radius: 8px;\n                padding: 10px;\n                margin: 10px 0;\n                background: linear-gradient(135deg, #e3f2fd 0%, #f3e5f5 100%);\n            }\n            .linked-cards-wrapper {\n                margin-top: 8px;\n            }\n            .linked-card-item {\n                display: block;\n                padding: 6px 10px;\n                margin: 3px 0;\n                background-color: white;\n                border: 1px solid #e0e0e0;\n                border-radius: 6px;\n                color: #333;\n                cursor: pointer;\n                font-size: 12px;\n                transition: all 0.2s ease;\n                position: relative;\n                box-shadow: 0 1px 2px rgba(0,0,0,0.1);\n            }\n            .linked-card-item:hover {\n                background-color: #f5f5f5;\n                border-color: #2196f3;\n                transform: translateX(3px);\n                box-shadow: 0 2px 6px rgba(0,0,0,0.15);\n            }\n            .knowledge-point-status {\n                float: right;\n                font-size: 14px;\n                margin-left: 10px;\n            }\n            .status-reviewed { color: #4caf50; }\n            .status-pending { color: #ff9800; }\n            .linked-cards-title {\n                font-weight: bold;\n                text-align: center;\n                margin-bottom: 8px;\n                color: #1976d2;\n                font-size: 14px;\n            }\n            .linked-cards-tip {\n                font-size: 11px;\n                color: #666;\n                text-align: center;\n                margin-top: 6px;\n                font-style: italic;\n            }\n            </style>\n            '
-            links_html = '<div class="linked-cards-container">'
-            links_html += f"""<div class="linked-cards-title">{get_text('related_knowledge')}</div>"""
-            links_html += '<div class="linked-cards-wrapper">'
-            for link in linked_cards:
-                try:
-                    linked_card = mw.col.getCard(link['card_id'])
-                    if linked_card:
-                        is_reviewed = check_card_reviewed_today(linked_card)
-                        status_icon = '✅' if is_reviewed else '⏳'
-                        status_class = 'status-reviewed' if is_reviewed else 'status-pending'
-                        click_action = f"pycmd('linked_card:{link['card_id']}:{str(is_reviewed).lower()}')"
-                        safe_title = link['title'].replace('"', '&quot;').replace("'", '&#39;')
-                        safe_deck = link['deck'].replace('"', '&quot;').replace("'", '&#39;')
-                        tooltip = f"{safe_title} ({get_text('deck_label')}: {safe_deck})"
-                        links_html += f'<div class="linked-card-item" onclick="{click_action}" title="{tooltip}">📚 {safe_title}<span class="knowledge-point-status {status_class}">{status_icon}</span></div>'
-                    else:
-                        safe_title = link['title'].replace('"', '&quot;').replace("'", '&#39;')
-                        deleted_text = get_text('card_status_deleted')
-                        links_html += f'<div class="linked-card-item" style="opacity: 0.5; cursor: not-allowed;" title="{safe_title} ({deleted_text})">📚 {safe_title} ❌</div>'
-                except Exception as e:
-                    safe_title = link.get('title', get_text('card_status_unknown')).replace('"', '&quot;').replace("'", '&#39;')
-                    error_text = get_text('card_status_load_error')
-                    links_html += f'<div class="linked-card-item" style="opacity: 0.5; cursor: not-allowed;" title="{safe_title} ({error_text})">📚 {safe_title} ⚠️</div>'
-                    continue
-            links_html += '</div>'
-            links_html += f"""<div class="linked-cards-tip">{get_text('review_status_tip')}</div>"""
-            links_html += f"""<div class="linked-cards-tip">{get_text('deck_switch_notice')}</div>"""
-            links_html += '</div>'
-            html = css + html + links_html
+        cache_key = get_panel_cache_key(note)
+        links_html = panel_cache.get(cache_key)
+        if links_html is None:
+            if get_config('async_review_panel', False):
+                links_html = request_linked_cards_panel(card, note, cache_key)
+            else:
+                panel = load_linked_cards_panel(note)
+                links_html = build_linked_cards_html(panel)
+                panel_cache.put(cache_key, links_html, get_panel_card_ids(panel))
+        if links_html:
+            html += links_html
     except:
         pass
     return html
 
-def check_card_reviewed_today(card):
-    """Check if card has been reviewed today - compatible version"""
+def request_linked_cards_panel(card, note, cache_key):
+    """Resolve link status in background and return placeholder to fill later"""
+    global panel_generation
+    panel_generation += 1
+    token = panel_generation
+    version = panel_cache.version
+
+    def on_success(panel):
+        fill_linked_cards_panel(token, card.id, cache_key, panel, cache=version == panel_cache.version)
+    QueryOp(parent=mw, op=lambda col: load_linked_cards_panel(note), success=on_success).failure(lambda e: None).run_in_background()
+    return f'<div id="linked-cards-panel" data-token="{token}"></div><script>if (typeof queueLinkedCardsPanel === "function") queueLinkedCardsPanel();</script>'
+
+def prefetch_linked_cards_panels(card):
+    """Resolve and cache panels for the shown card and upcoming queued cards while the question is up"""
+    if not get_config('prefetch_review_panels', True):
+        return
+    depth = get_config('prefetch_queue_depth', 0)
+    version = panel_cache.version
     try:
-        try:
-            import time
-            today_start = int(time.time()) - int(time.time()) % 86400
-        except:
-            try:
-                today_start = mw.col.sched.day_cutoff - 86400
-            except:
-                import time
-                today_start = int(time.time()) - 86400
-        reviews = mw.col.db.list('select id from revlog where cid = ? and id > ?', card.id, today_start * 1000)
-        return len(reviews) > 0
+        skip_note_id = card.nid if panel_cache.get(get_panel_cache_key(card.note())) is not None else None
+    except:
+        skip_note_id = None
+
+    def op(col):
+        note_ids = [card.nid] + get_queued_note_ids(col, depth)
+        panels = []
+        for note_id in dict.fromkeys(note_ids):
+            if note_id == skip_note_id:
+                continue
+            note = col.get_note(note_id)
+            panels.append((note, load_linked_cards_panel(note)))
+        return panels
+
+    def on_success(panels):
+        if version != panel_cache.version:
+            return
+        for note, panel in panels:
+            cache_key = get_panel_cache_key(note)
+            if panel_cache.get(cache_key) is None:
+                panel_cache.put(cache_key, build_linked_cards_html(panel), get_panel_card_ids(panel))
+    QueryOp(parent=mw, op=op, success=on_success).failure(lambda e: None).run_in_background()
+
+def get_queued_note_ids(col, depth):
+    """Get note ids of the next queued cards, empty when the scheduler cannot peek"""
+    if depth <= 0:
+        return []
+    try:
+        queued = col.sched.get_queued_cards(fetch_limit=depth + 1)
+        return [queued_card.card.note_id for queued_card in queued.cards]
+    except:
+        return []
+
+def fill_linked_cards_panel(token, card_id, cache_key, panel, cache=True):
+    """Push resolved panel into the reviewer, dropping results for cards already left, caching only results not outdated meanwhile"""
+    try:
+        if token != panel_generation:
+            return
+        if not mw.reviewer or not mw.reviewer.card or mw.reviewer.card.id != card_id or mw.reviewer.state != 'answer':
+            return
+        links_html = build_linked_cards_html(panel)
+        if cache:
+            panel_cache.put(cache_key, links_html, get_panel_card_ids(panel))
+        mw.reviewer.web.eval(f'fillLinkedCardsPanel({token}, {json.dumps(links_html)});')
+    except:
+        pass
+
+def get_panel_cache_key(note):
+    """Get render cache key for the linked-cards panel of a note"""
+    try:
+        field_content = note[card_linker.linked_cards_field]
+    except KeyError:
+        field_content = ''
+    return panel_cache.make_key(note, field_content, mw.col.sched.day_cutoff, get_language())
+
+def load_linked_cards_panel(note):
+    """Load outgoing links, backlinks and their status for a note - safe to run in background"""
+    linked_cards = card_linker.get_linked_cards(note)
+    backlinks = card_linker.get_backlinks(note)
+    card_ids = [link.get('card_id') for link in linked_cards] + [link['card_id'] for link in backlinks]
+    statuses = link_status_resolver.resolve(card_ids) if card_ids else {}
+    return (linked_cards, backlinks, statuses)
+
+def get_panel_card_ids(panel):
+    """Get ids of every card whose status a panel shows"""
+    linked_cards, backlinks, statuses = panel
+    return [link.get('card_id') for link in linked_cards] + [link['card_id'] for link in backlinks]
+
+def build_linked_cards_html(panel):
+    """Render linked-cards panel html, empty when there are no links"""
+    linked_cards, backlinks, statuses = panel
+    if not linked_cards and not backlinks:
+        return ''
+    links_html = '<div class="linked-cards-container">'
+    if linked_cards:
+        links_html += f"""<div class="linked-cards-title">{get_text('related_knowledge')}</div>"""
+        links_html += '<div class="linked-cards-wrapper">'
+        for link in linked_cards:
+            links_html += build_linked_card_item(link, statuses)
+        links_html += '</div>'
+    if backlinks:
+        links_html += f"""<div class="linked-cards-title">{get_text('linked_from')}</div>"""
+        links_html += '<div class="linked-cards-wrapper">'
+        for link in backlinks:
+            links_html += build_linked_card_item(link, statuses)
+        links_html += '</div>'
+    links_html += f"""<div class="linked-cards-tip">{get_text('review_status_tip')}</div>"""
+    links_html += f"""<div class="linked-cards-tip">{get_text('deck_switch_notice')}</div>"""
+    links_html += '</div>'
+    return links_html
+
+def build_linked_card_item(link, statuses):
+    """Render a single linked card row"""
+    try:
+        status = statuses.get(link['card_id'])
+        safe_title = link['title'].replace('"', '&quot;').replace("'", '&#39;')
+        if status:
+            is_reviewed = status['reviewed']
+            status_icon = '✅' if is_reviewed else '⏳'
+            status_class = 'status-reviewed' if is_reviewed else 'status-pending'
+            click_action = f"openLinkedCard({link['card_id']}, {str(is_reviewed).lower()})"
+            deck = link['deck'] if 'deck' in link else card_linker.deck_cache.name(status['did'])
+            safe_deck = deck.replace('"', '&quot;').replace("'", '&#39;')
+            tooltip = f"{safe_title} ({get_text('deck_label')}: {safe_deck})"
+            return f'<div class="linked-card-item" onclick="{click_action}" title="{tooltip}">📚 {safe_title}<span class="knowledge-point-status {status_class}">{status_icon}</span></div>'
+        deleted_text = get_text('card_status_deleted')
+        return f'<div class="linked-card-item linked-card-unavailable" title="{safe_title} ({deleted_text})">📚 {safe_title} ❌</div>'
     except Exception as e:
-        return False
+        safe_title = link.get('title', get_text('card_status_unknown')).replace('"', '&quot;').replace("'", '&#39;')
+        error_text = get_text('card_status_load_error')
+        return f'<div class="linked-card-item linked-card-unavailable" title="{safe_title} ({error_text})">📚 {safe_title} ⚠️</div>'
 
 def is_card_in_current_deck(card):
     """Check if card is in the current review deck"""
     try:
         if not mw.reviewer or not mw.reviewer.card:
             return False
-        current_deck_id = mw.reviewer.card.did
-        target_deck_id = card.did
-        if current_deck_id == target_deck_id:
-            return True
-        current_deck_name = mw.col.decks.name(current_deck_id)
-        target_deck_name = mw.col.decks.name(target_deck_id)
-        if target_deck_name.startswith(current_deck_name + '::'):
-            return True
-        return False
+        return card_linker.deck_cache.contains(mw.reviewer.card.did, card.did)
     except Exception as e:
         return False
 
@@ -270,5 +368,134 @@ def on_reviewer_init():
     """Setup handler when reviewer initializes"""
     setup_link_handler()
 
+def inject_review_assets(web_content, context):
+    """Load panel styles and scripts once per reviewer page instead of per card"""
+    from aqt.reviewer import Reviewer
+    if isinstance(context, Reviewer):
+        web_content.css.append(f'/_addons/{addon_package}/web/card_linker.css')
+        web_content.js.append(f'/_addons/{addon_package}/web/card_linker.js')
+
+gui_hooks.webview_will_set_content.append(inject_review_assets)
 gui_hooks.reviewer_did_init.append(lambda x: setup_link_handler())
-gui_hooks.card_will_show.append(add_linked_cards_to_review)
\ No newline at end of file
+gui_hooks.card_will_show.append(add_linked_cards_to_review)
+
+def on_reviewer_did_answer_card(reviewer, card, ease):
+    """Record the review and refresh status icons of panels that show the answered card"""
+    link_status_resolver.mark_reviewed(card.id)
+    panel_cache.invalidate_cards([card.id])
+
+def on_review_history_changed(*args):
+    """Reload reviewed-today set after profile open, undo or sync"""
+    link_status_resolver.reset()
+    panel_cache.clear()
+
+def on_note_will_flush(note):
+    """Drop panels rendered for an older version of the note and pick up its link changes - fires in op threads, so the cache is touched on the main thread"""
+    note_id = note.id
+    mw.taskman.run_on_main(lambda: panel_cache.invalidate_note(note_id))
+    card_linker.change_tracker.schedule()
+
+def on_sync_did_finish():
+    """Pick up link and deck changes and deletions brought in by sync"""
+    card_linker.deck_cache.reset()
+    card_linker.change_tracker.schedule(check_deleted=True)
+
+def setup_tools_menu():
+    """Add maintenance actions to the Tools menu"""
+    menu = QMenu(get_text('menu_title'), mw)
+    actions = [('menu_migrate_links', card_linker.maintenance.migrate_to_compact), ('menu_refresh_links', card_linker.maintenance.refresh_link_details), ('menu_check_dangling_links', card_linker.maintenance.check_dangling_links)]
+    for text_key, handler in actions:
+        action = QAction(get_text(text_key), mw)
+        qconnect(action.triggered, handler)
+        menu.addAction(action)
+    mw.form.menuTools.addMenu(menu)
+
+setup_tools_menu()
+
+def on_profile_did_open():
+    """Open link index and caches for the loaded profile"""
+    try:
+        card_linker.sidecar.open()
+        card_linker.link_index.open()
+        card_linker.search_index.open()
+        card_linker.link_suggester.open()
+        card_linker.title_cache.open()
+        card_linker.change_tracker.open()
+    except Exception as e:
+        print(f'Link index open failed: {e}')
+
+def on_profile_will_close():
+    """Close link index and drop link graph before the profile unloads"""
+    card_linker.sidecar.close()
+    card_linker.link_graph.reset()
+    card_linker.fuzzy_index.reset()
+    card_linker.search_candidates.clear()
+    card_linker.link_suggester.reset()
+    card_linker.title_cache.clear()
+    card_linker.deck_cache.reset()
+
+def on_note_added(note):
+    """Index links of a newly added note"""
+    card_linker.update_link_data(note)
+
+def on_notes_will_be_deleted(col, note_ids):
+    """Queue cards of deleted notes for unlinking when enabled, then drop their index rows from the main thread"""
+    note_ids = list(note_ids)
+    try:
+        card_linker.maintenance.prune_links_to_deleted_notes(col, note_ids)
+    except Exception as e:
+        print(f'Dangling link cleanup failed: {e}')
+    card_linker.change_tracker.record_notes(note_ids)
+    card_linker.search_index.remove_notes(note_ids)
+    card_linker.link_suggester.remove_notes(note_ids)
+    mw.taskman.run_on_main(lambda: on_notes_deleted(note_ids))
+
+def on_notes_deleted(note_ids):
+    """Drop link index, graph and title rows of deleted notes - the hook runs in the delete op's thread"""
+    card_linker.remove_link_data(note_ids)
+    try:
+        card_linker.title_cache.remove_notes(note_ids)
+    except Exception as e:
+        print(f'Title cache cleanup failed: {e}')
+    card_linker.change_tracker.schedule()
+
+def on_link_index_changed(card_ids):
+    """Drop panels whose backlinks may have changed"""
+    panel_cache.clear()
+
+def on_state_did_undo(changes):
+    """Re-index notes an undo may have taken back to an older mod and usn"""
+    try:
+        note_changed = changes.changes.note_text
+    except:
+        note_changed = True
+    if note_changed:
+        card_linker.change_tracker.requeue_after_undo()
+
+def on_operation_did_execute(changes, handler):
+    """Drop panels after deck renames or card changes made outside the reviewer, track note, card and deck edits, prune links to deleted notes"""
+    if changes.deck:
+        card_linker.deck_cache.reset()
+    if changes.deck or (changes.card and handler is not mw.reviewer):
+        panel_cache.clear()
+    if changes.note_text or changes.deck or (changes.card and handler is not mw.reviewer):
+        card_linker.change_tracker.schedule()
+    try:
+        card_linker.maintenance.prune_deleted_card_links()
+    except Exception as e:
+        print(f'Dangling link cleanup failed: {e}')
+
+gui_hooks.reviewer_did_show_question.append(prefetch_linked_cards_panels)
+gui_hooks.reviewer_did_answer_card.append(on_reviewer_did_answer_card)
+hooks.note_will_flush.append(on_note_will_flush)
+gui_hooks.operation_did_execute.append(on_operation_did_execute)
+gui_hooks.profile_did_open.append(on_review_history_changed)
+gui_hooks.profile_did_open.append(on_profile_did_open)
+gui_hooks.profile_will_close.append(on_profile_will_close)
+gui_hooks.add_cards_did_add_note.append(on_note_added)
+card_linker.link_index.listeners.append(on_link_index_changed)
+hooks.notes_will_be_deleted.append(on_notes_will_be_deleted)
+gui_hooks.state_did_undo.append(on_review_history_changed)
+gui_hooks.state_did_undo.append(on_state_did_undo)
+gui_hooks.sync_did_finish.append(on_review_history_changed)
+gui_hooks.sync_did_finish.append(on_sync_did_finish)
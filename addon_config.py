@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration access for Card Linker Plugin
+"""
+
+cached_config = None
+
+def get_config(key, default=None):
+    """Get add-on config value, falling back to default - read from disk once, then served from memory"""
+    global cached_config
+    try:
+        if cached_config is None:
+            from aqt import mw
+            cached_config = mw.addonManager.getConfig(__name__) or {}
+        if key in cached_config:
+            return cached_config[key]
+    except:
+        pass
+    return default
+
+def reload_config(config=None):
+    """Replace cached config after the user edits it, re-reading it on next use when not given"""
+    global cached_config
+    cached_config = config
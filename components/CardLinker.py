@@ -2,14 +2,45 @@ from aqt import mw
 from aqt.qt import *
 from aqt.utils import showInfo
 from anki.notes import Note
+from anki.utils import ids2str
+import re
 import json
 from ..lang import get_text
+from ..addon_config import get_config
 from .LinkDialog import LinkDialog
+from .SidecarDatabase import SidecarDatabase
+from .LinkIndex import LinkIndex
+from .SearchIndex import SearchIndex
+from .FuzzyIndex import FuzzyIndex
+from .SearchCandidates import SearchCandidates
+from .LinkSuggester import LinkSuggester
+from .LinkGraph import LinkGraph
+from .LinkChangeTracker import LinkChangeTracker
+from .LinkParser import LinkParser, LinkRecord
+from .LinkMaintenance import LinkMaintenance
+from .TitleCache import TitleCache
+from .DeckCache import DeckCache
+
+HTML_TAG = re.compile('<[^>]+>')
+WHITESPACE = re.compile('\\s+')
+TITLE_SPECIAL_CHARS = re.compile('[^\\w\\s\\u4e00-\\u9fff.,!?;:()\\-\\[\\]{}"]')
 
 class CardLinker:
 
     def __init__(self):
         self.linked_cards_field = 'LinkedCards'
+        self.link_parser = LinkParser()
+        self.sidecar = SidecarDatabase()
+        self.link_index = LinkIndex(self, self.sidecar)
+        self.search_index = SearchIndex(self, self.sidecar)
+        self.fuzzy_index = FuzzyIndex(self)
+        self.search_candidates = SearchCandidates()
+        self.link_suggester = LinkSuggester(self, self.sidecar)
+        self.title_cache = TitleCache(self, self.sidecar)
+        self.link_graph = LinkGraph(self)
+        self.change_tracker = LinkChangeTracker(self)
+        self.deck_cache = DeckCache()
+        self.maintenance = LinkMaintenance(self)
 
     def setup_editor_button(self, buttons, editor):
         """Add link button to editor"""
@@ -111,27 +142,69 @@ class CardLinker:
         dialog = LinkDialog(editor, self)
         dialog.exec()
 
-    def search_cards(self, query):
-        """Search cards"""
+    def search_cards(self, query, mode='standard'):
+        """Search cards, fuzzy mode ranks by n-gram similarity, standard mode uses the full-text index for plain text and Anki's search otherwise"""
+        return self.search(query, mode)[0]
+
+    def search(self, query, mode='standard'):
+        """Search cards, returning (first page of result rows, card ids of further hits to hydrate on demand)"""
         try:
-            card_ids = mw.col.findCards(query)
-            cards = []
-            for card_id in card_ids[:30]:
-                card = mw.col.getCard(card_id)
-                note = card.note()
-                raw_question = note.fields[0] if note.fields else ''
-                clean_question = self.clean_card_title_for_search(raw_question)
-                cards.append({'id': card_id, 'note_id': note.id, 'question': clean_question[:80], 'deck': mw.col.decks.name(card.did)})
-            return cards
+            limit = get_config('max_search_results', 30)
+            if mode == 'fuzzy':
+                return (self.fuzzy_index.search(mw.col, query, limit), [])
+            cards = self.search_index.search(query, limit)
+            if cards:
+                self.search_candidates.clear()
+                return (cards, [])
+            entries = self.search_candidates.refine(query)
+            if entries is None:
+                card_ids = mw.col.findCards(query)
+                if len(card_ids) > self.search_candidates.max_size:
+                    self.search_candidates.clear()
+                    return (self.hydrate_search_results(card_ids[:limit]), card_ids[limit:])
+                entries = self.load_search_entries(card_ids)
+                self.search_candidates.store(query, entries)
+            return (self.make_search_results(entries[:limit]), [entry[0] for entry in entries[limit:]])
         except:
+            return ([], [])
+
+    def hydrate_search_results(self, card_ids):
+        """Load result rows for card ids with one joined query, keeping search order"""
+        return self.make_search_results(self.load_search_entries(card_ids))
+
+    def load_search_entries(self, card_ids):
+        """Get (card id, note id, deck id, note mod, raw fields) for card ids with one joined query, keeping search order"""
+        if not card_ids:
             return []
+        rows = {}
+        for card_id, note_id, deck_id, mod, flds in mw.col.db.all(f'select c.id, c.nid, c.did, n.mod, n.flds from cards c join notes n on n.id = c.nid where c.id in {ids2str(card_ids)}'):
+            rows[card_id] = (card_id, note_id, deck_id, mod, flds)
+        return [rows[card_id] for card_id in card_ids if card_id in rows]
+
+    def make_search_results(self, entries):
+        """Build result rows with cached cleaned titles and deck names from search entries"""
+        deck_names = self.deck_cache.get_names()
+        titles = self.title_cache.get_titles([(note_id, mod, flds.split('\x1f')[0]) for card_id, note_id, deck_id, mod, flds in entries])
+        cards = []
+        for (card_id, note_id, deck_id, mod, flds), (title, link_title) in zip(entries, titles):
+            cards.append({'id': card_id, 'note_id': note_id, 'question': title, 'title': link_title, 'deck': deck_names.get(deck_id) or self.deck_cache.name(deck_id)})
+        return cards
 
     def clean_card_title_for_search(self, title):
         """Clean card title for search results"""
-        import re
-        clean_title = re.sub('<[^>]+>', '', title)
-        clean_title = re.sub('\\s+', ' ', clean_title).strip()
-        return clean_title
+        return WHITESPACE.sub(' ', HTML_TAG.sub('', title)).strip()
+
+    def clean_card_title(self, title):
+        """Clean card title, remove HTML tags and special characters"""
+        return TITLE_SPECIAL_CHARS.sub('', self.clean_card_title_for_search(title))
+
+    def make_link_title(self, raw_field):
+        """Build the link title shown for a card from its raw first field"""
+        return self.clean_card_title(self.clean_card_title_for_search(raw_field)[:80])[:50]
+
+    def get_link_titles(self, rows):
+        """Get cached link titles for (note id, mod, raw fields) rows"""
+        return [link_title for title, link_title in self.title_cache.get_titles([(note_id, mod, flds.split('\x1f')[0]) for note_id, mod, flds in rows])]
 
     def create_new_card(self, current_note, front, back):
         """Create new card"""
@@ -156,52 +229,121 @@ class CardLinker:
         """Insert link in editor - only store JSON data, no visual link display"""
         pass
 
-    def add_link_to_note(self, note, card_id, link_text):
-        """Add link to note"""
-        try:
-            linked_cards = self.get_linked_cards(note)
-            if not any((link['card_id'] == card_id for link in linked_cards)):
-                card = mw.col.getCard(card_id)
-                if not card:
-                    showInfo(get_text('error_card_not_found').format(card_id))
-                    return False
-                linked_note = card.note()
-                link_info = {'card_id': card_id, 'note_id': linked_note.id, 'title': link_text, 'deck': mw.col.decks.name(card.did)}
-                linked_cards.append(link_info)
-                success = self.save_linked_cards(note, linked_cards)
-                if not success:
-                    showInfo(get_text('error_save_link_failed'))
-                    return False
-                return True
-            else:
-                showInfo(get_text('error_card_already_linked'))
-                return True
-        except Exception as e:
-            showInfo(get_text('save_link_failed').format(str(e)))
-            return False
-
     def get_linked_cards(self, note):
         """Get linked cards"""
         try:
-            field_content = note[self.linked_cards_field] or '[]'
-            return json.loads(field_content)
+            return self.parse_linked_cards(note[self.linked_cards_field])
         except:
             return []
 
-    def save_linked_cards(self, note, linked_cards):
-        """Save linked cards"""
+    def get_linked_card_ids(self, note):
+        """Get linked card ids without resolving titles"""
         try:
-            json_data = json.dumps(linked_cards, ensure_ascii=False)
-            print(get_text('debug_save_link_data').format(json_data))
-            note[self.linked_cards_field] = json_data
-            if note.id != 0:
-                mw.col.updateNote(note)
-                mw.col.save()
-                print(get_text('debug_save_success').format(self.linked_cards_field))
-            return True
-        except Exception as e:
-            error_msg = get_text('save_failed').format(str(e))
-            print(get_text('debug_save_failed').format(error_msg))
-            showInfo(error_msg)
-            return False
+            return self.parse_link_ids(note[self.linked_cards_field])
+        except:
+            return []
 
+    def parse_linked_cards(self, field_content):
+        """Parse raw LinkedCards field content in either storage format"""
+        try:
+            version, data = self.decode_linked_cards(field_content)
+            if version == 1:
+                return list(data)
+            return self.resolve_link_details(data)
+        except:
+            return []
+
+    def parse_link_ids(self, field_content):
+        """Parse card ids out of raw LinkedCards field content in either storage format"""
+        try:
+            version, data = self.decode_linked_cards(field_content)
+            if version == 1:
+                return [link.card_id for link in data if link.card_id is not None]
+            return list(data)
+        except:
+            return []
+
+    def decode_linked_cards(self, field_content):
+        """Decode raw field into (format version, data) - v1 is a tuple of LinkRecords, v2 a tuple of card ids"""
+        return self.link_parser.decode(field_content)
+
+    def encode_linked_cards(self, linked_cards, compact=None):
+        """Encode links for storage, compact v2 format stores card ids only"""
+        if compact is None:
+            compact = get_config('compact_link_storage', True)
+        if compact:
+            return json.dumps({'v': 2, 'c': [int(link['card_id']) for link in linked_cards]}, separators=(',', ':'))
+        return json.dumps([link.to_dict() if isinstance(link, LinkRecord) else link for link in linked_cards], ensure_ascii=False)
+
+    def resolve_link_details(self, card_ids):
+        """Resolve note id, title and deck for card ids with one joined query"""
+        details = {}
+        if card_ids:
+            rows = mw.col.db.all(f'select c.id, c.nid, c.did, n.mod, n.flds from cards c join notes n on n.id = c.nid where c.id in {ids2str(card_ids)}')
+            titles = self.get_link_titles([(note_id, mod, flds) for card_id, note_id, deck_id, mod, flds in rows])
+            for (card_id, note_id, deck_id, mod, flds), title in zip(rows, titles):
+                details[card_id] = LinkRecord(card_id, note_id, title, self.deck_cache.name(deck_id))
+        return [details.get(card_id) or LinkRecord(card_id, None, get_text('card_status_unknown'), '') for card_id in card_ids]
+
+    def get_backlinks(self, note):
+        """Get notes linking to any card of the given note, via the reverse link index"""
+        if not note.id or not self.link_index.is_ready():
+            return []
+        note_ids = [note_id for note_id in self.link_index.get_backlinks(note.card_ids()) if note_id != note.id]
+        if not note_ids:
+            return []
+        rows = mw.col.db.all(f'select c.nid, min(c.id), n.mod, n.flds from cards c join notes n on n.id = c.nid where c.nid in {ids2str(note_ids)} group by c.nid')
+        titles = self.get_link_titles([(note_id, mod, flds) for note_id, card_id, mod, flds in rows])
+        return [{'card_id': card_id, 'note_id': note_id, 'title': title} for (note_id, card_id, mod, flds), title in zip(rows, titles)]
+
+    def update_link_data(self, note):
+        """Apply a note's current links to the link index and graph"""
+        if note.id:
+            self.apply_link_changes(note.id, self.get_linked_card_ids(note))
+
+    def apply_link_changes(self, note_id, card_ids):
+        """Apply a note's linked card ids to the link index and graph"""
+        self.link_index.update_links(note_id, card_ids)
+        self.link_graph.update_links(note_id, card_ids)
+
+    def remove_link_data(self, note_ids):
+        """Drop deleted notes from the link index and graph"""
+        self.link_index.remove_notes(note_ids)
+        self.link_graph.remove_notes(note_ids)
+
+    def get_linked_field_ords(self):
+        """Get {model id: field ord} for every note type with LinkedCards field"""
+        ords = {}
+        for model in mw.col.models.all():
+            for field in model['flds']:
+                if field['name'] == self.linked_cards_field:
+                    ords[model['id']] = field['ord']
+        return ords
+
+    def get_change_checkpoint(self, col, table='notes'):
+        """Get (max mod, max usn) of notes or cards, the collection state an index is brought up to"""
+        return (col.db.scalar(f'select max(mod) from {table}') or 0, col.db.scalar(f'select max(usn) from {table}') or 0)
+
+    def get_changed_ids(self, col, checkpoint, table='notes', column='id'):
+        """Get ids of rows modified or synced since a (mod, usn) checkpoint - sync keeps the older mod but sets a new usn - None when a full sync replaced the collection"""
+        mod, usn = checkpoint
+        if usn is None:
+            return col.db.list(f'select {column} from {table} where mod >= ?', mod)
+        if (col.db.scalar(f'select max(usn) from {table}') or 0) < usn:
+            return None
+        return col.db.list(f'select {column} from {table} where mod >= ? or usn > ?', mod, usn)
+
+    def iter_linked_cards_fields(self, note_ids=None, include_empty=False):
+        """Yield (note id, raw LinkedCards field) for notes whose type has the field, empty ones only when tracking changes"""
+        ords = self.get_linked_field_ords()
+        if not ords:
+            return
+        query = f'select id, mid, flds from notes where mid in {ids2str(ords)}'
+        if note_ids is not None:
+            query += f' and id in {ids2str(note_ids)}'
+        for note_id, model_id, flds in mw.col.db.execute(query):
+            fields = flds.split('\x1f')
+            ord = ords[model_id]
+            field_content = fields[ord] if ord < len(fields) else ''
+            if field_content or include_empty:
+                yield (note_id, field_content)
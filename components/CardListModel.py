@@ -0,0 +1,132 @@
+from array import array
+from aqt.qt import *
+from ..lang import get_text
+
+try:
+    from PyQt6.QtCore import Qt
+    DISPLAY_ROLE = Qt.ItemDataRole.DisplayRole
+    BACKGROUND_ROLE = Qt.ItemDataRole.BackgroundRole
+    USER_ROLE = Qt.ItemDataRole.UserRole
+except:
+    from PyQt5.QtCore import Qt
+    DISPLAY_ROLE = Qt.DisplayRole
+    BACKGROUND_ROLE = Qt.BackgroundRole
+    USER_ROLE = Qt.UserRole
+
+class CardListModel(QAbstractListModel):
+    """List model over card row dicts, each row dict exposed under USER_ROLE"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cards = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.cards)
+
+    def data(self, index, role=DISPLAY_ROLE):
+        card = self.card_at(index.row()) if index.isValid() else None
+        if card is None:
+            return None
+        if role == DISPLAY_ROLE:
+            return self.display_text(index.row(), card)
+        if role == USER_ROLE:
+            return card
+        return None
+
+    def card_at(self, row):
+        """Get row dict, None when out of range"""
+        return self.cards[row] if 0 <= row < len(self.cards) else None
+
+    def display_text(self, row, card):
+        return str(card.get('id'))
+
+    def refresh_rows(self, first=0):
+        """Repaint rows from first onward after the state they show changed"""
+        if first < len(self.cards):
+            self.dataChanged.emit(self.index(first), self.index(len(self.cards) - 1))
+
+class SelectedCardsModel(CardListModel):
+    """Cards linked from the current note, numbered in link order"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.card_ids = set()
+
+    def display_text(self, row, card):
+        return f"{row + 1}. {card['display_text']} ({card['deck']})"
+
+    def set_cards(self, cards):
+        """Replace all rows"""
+        self.beginResetModel()
+        self.cards = list(cards)
+        self.card_ids = {card['id'] for card in self.cards}
+        self.endResetModel()
+
+    def append_card(self, card):
+        """Add a row at the end"""
+        self.beginInsertRows(QModelIndex(), len(self.cards), len(self.cards))
+        self.cards.append(card)
+        self.card_ids.add(card['id'])
+        self.endInsertRows()
+
+    def remove_card(self, card_id):
+        """Remove the row of a card and renumber the rows after it"""
+        for row, card in enumerate(self.cards):
+            if card['id'] == card_id:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.cards[row]
+                self.card_ids.discard(card_id)
+                self.endRemoveRows()
+                self.refresh_rows(row)
+                return
+
+class SearchResultsModel(CardListModel):
+    """Search results whose further hits are hydrated a page at a time as the view scrolls"""
+
+    def __init__(self, loader, selected_model, exclude_note_id=None, batch_size=50, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        self.selected_model = selected_model
+        self.exclude_note_id = exclude_note_id
+        self.batch_size = batch_size
+        self.pending_ids = array('q')
+        self.pending_start = 0
+
+    def data(self, index, role=DISPLAY_ROLE):
+        if role == BACKGROUND_ROLE:
+            card = self.card_at(index.row()) if index.isValid() else None
+            if card is not None and card['id'] in self.selected_model.card_ids:
+                return QColor(200, 255, 200)
+            return None
+        return super().data(index, role)
+
+    def display_text(self, row, card):
+        text = f"{card['question']} ({get_text('deck_label')}: {card['deck']})"
+        if card['id'] in self.selected_model.card_ids:
+            return f'✅ {text}'
+        return text
+
+    def set_results(self, cards, more_card_ids=()):
+        """Replace results with a first page of rows and the card ids of hits still to load"""
+        self.beginResetModel()
+        self.cards = [card for card in cards if card['note_id'] != self.exclude_note_id]
+        self.pending_ids = array('q', more_card_ids)
+        self.pending_start = 0
+        self.endResetModel()
+
+    def clear(self):
+        self.set_results([])
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.pending_start < len(self.pending_ids)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        card_ids = list(self.pending_ids[self.pending_start:self.pending_start + self.batch_size])
+        self.pending_start += len(card_ids)
+        cards = [card for card in self.loader(card_ids) if card['note_id'] != self.exclude_note_id]
+        if cards:
+            self.beginInsertRows(QModelIndex(), len(self.cards), len(self.cards) + len(cards) - 1)
+            self.cards.extend(cards)
+            self.endInsertRows()
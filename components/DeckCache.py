@@ -0,0 +1,49 @@
+import threading
+from aqt import mw
+
+class DeckCache:
+    """Deck names and descendant sets, built once per collection and dropped after deck changes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget cached decks after decks were added, renamed or deleted"""
+        self.names = None
+        self.descendants = None
+
+    def load(self, col=None):
+        """Get ({deck id: name}, {deck id: ids of the deck and all decks below it}), building them on first use"""
+        with self.lock:
+            if self.names is None:
+                names = {deck.id: deck.name for deck in (col or mw.col).decks.all_names_and_ids()}
+                ids_by_name = {name: deck_id for deck_id, name in names.items()}
+                descendants = {deck_id: {deck_id} for deck_id in names}
+                for deck_id, name in names.items():
+                    parts = name.split('::')
+                    for depth in range(1, len(parts)):
+                        parent_id = ids_by_name.get('::'.join(parts[:depth]))
+                        if parent_id is not None:
+                            descendants[parent_id].add(deck_id)
+                self.names, self.descendants = (names, descendants)
+            return (self.names, self.descendants)
+
+    def get_names(self, col=None):
+        """Get {deck id: deck name}"""
+        return self.load(col)[0]
+
+    def name(self, deck_id, col=None):
+        """Get deck name, asking the collection for decks not in the cache"""
+        name = self.get_names(col).get(deck_id)
+        if name is None:
+            name = (col or mw.col).decks.name(deck_id)
+        return name
+
+    def get_descendants(self, deck_id):
+        """Get ids of the deck and all decks below it"""
+        return self.load()[1].get(deck_id, {deck_id})
+
+    def contains(self, ancestor_id, deck_id):
+        """Check if a deck is the given deck or one of its subdecks"""
+        return deck_id in self.get_descendants(ancestor_id)
@@ -0,0 +1,124 @@
+from aqt.qt import *
+from aqt.operations import QueryOp
+from anki.utils import ids2str
+from ..lang import get_text
+from .CardListModel import USER_ROLE
+
+try:
+    from PyQt6.QtWidgets import QTreeWidgetItem
+    SHOW_INDICATOR = QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator
+    HIDE_INDICATOR = QTreeWidgetItem.ChildIndicatorPolicy.DontShowIndicatorWhenChildless
+except:
+    from PyQt5.QtWidgets import QTreeWidgetItem
+    SHOW_INDICATOR = QTreeWidgetItem.ShowIndicator
+    HIDE_INDICATOR = QTreeWidgetItem.DontShowIndicatorWhenChildless
+
+class DeckTreePicker(QTreeWidget):
+    """Deck to note tree whose subdecks, notes and counts are loaded in background when a deck is expanded"""
+    card_activated = pyqtSignal(object)
+
+    def __init__(self, card_linker, exclude_note_id=None, page_size=200, parent=None):
+        super().__init__(parent)
+        self.card_linker = card_linker
+        self.exclude_note_id = exclude_note_id
+        self.page_size = page_size
+        self.closed = False
+        self.loaded = False
+        self.expanded_deck_ids = set()
+        self.setHeaderHidden(True)
+        self.setUniformRowHeights(True)
+        self.itemExpanded.connect(self.on_item_expanded)
+        self.itemDoubleClicked.connect(self.on_item_double_clicked)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.loaded:
+            self.loaded = True
+            names = self.card_linker.deck_cache.get_names()
+            self.add_deck_items(self.invisibleRootItem(), [deck_id for deck_id, name in names.items() if '::' not in name])
+
+    def get_child_deck_ids(self, deck_id):
+        """Get ids of decks directly below a deck"""
+        names = self.card_linker.deck_cache.get_names()
+        depth = names[deck_id].count('::') + 1
+        return [child_id for child_id in self.card_linker.deck_cache.get_descendants(deck_id) if child_id != deck_id and names[child_id].count('::') == depth]
+
+    def add_deck_items(self, parent_item, deck_ids):
+        """Add deck rows sorted by name and fill in their note counts in background"""
+        names = self.card_linker.deck_cache.get_names()
+        items = {}
+        for deck_id in sorted(deck_ids, key=lambda deck_id: names[deck_id].lower()):
+            item = QTreeWidgetItem([names[deck_id].split('::')[-1]])
+            item.setData(0, USER_ROLE, ('deck', deck_id))
+            item.setChildIndicatorPolicy(SHOW_INDICATOR)
+            parent_item.addChild(item)
+            items[deck_id] = item
+        if not items:
+            return
+
+        def on_success(counts):
+            if self.closed:
+                return
+            for deck_id, item in items.items():
+                item.setText(0, f"{names[deck_id].split('::')[-1]} ({counts.get(deck_id, 0)})")
+        QueryOp(parent=self, op=lambda col: self.load_counts(col, list(items)), success=on_success).run_in_background()
+
+    def load_counts(self, col, deck_ids):
+        """Get {deck id: distinct notes in the deck and its subdecks} with one query per deck, so notes spread over subdecks count once"""
+        return {deck_id: col.db.scalar(f'select count(distinct nid) from cards where did in {ids2str(self.card_linker.deck_cache.get_descendants(deck_id))}') or 0 for deck_id in deck_ids}
+
+    def on_item_expanded(self, item):
+        """Load subdecks and the first page of notes the first time a deck is expanded"""
+        kind = item.data(0, USER_ROLE)
+        if not kind or kind[0] != 'deck' or kind[1] in self.expanded_deck_ids:
+            return
+        self.expanded_deck_ids.add(kind[1])
+        self.add_deck_items(item, self.get_child_deck_ids(kind[1]))
+        self.load_notes(item, kind[1], 0)
+
+    def load_notes(self, parent_item, deck_id, after_note_id):
+        """Add a page of notes with cards directly in a deck, after the given note id"""
+
+        def op(col):
+            rows = col.db.all('select c.nid, min(c.id), n.mod, n.flds from cards c join notes n on n.id = c.nid where c.did = ? and c.nid > ? group by c.nid order by c.nid limit ?', deck_id, after_note_id, self.page_size + 1)
+            titles = self.card_linker.title_cache.get_titles([(note_id, mod, flds.split('\x1f')[0]) for note_id, card_id, mod, flds in rows[:self.page_size]])
+            deck_name = self.card_linker.deck_cache.name(deck_id, col)
+            cards = [{'id': card_id, 'note_id': note_id, 'question': title, 'title': link_title, 'deck': deck_name} for (note_id, card_id, mod, flds), (title, link_title) in zip(rows, titles)]
+            return (cards, len(rows) > self.page_size)
+
+        def on_success(result):
+            if self.closed:
+                return
+            cards, has_more = result
+            for card in cards:
+                if card['note_id'] == self.exclude_note_id:
+                    continue
+                item = QTreeWidgetItem([card['question']])
+                item.setData(0, USER_ROLE, ('note', card))
+                item.setToolTip(0, card['question'])
+                parent_item.addChild(item)
+            if has_more:
+                item = QTreeWidgetItem([get_text('tree_load_more')])
+                item.setData(0, USER_ROLE, ('more', deck_id, cards[-1]['note_id']))
+                parent_item.addChild(item)
+            if not parent_item.childCount():
+                parent_item.setChildIndicatorPolicy(HIDE_INDICATOR)
+        QueryOp(parent=self, op=op, success=on_success).run_in_background()
+
+    def current_card(self):
+        """Get row dict of the selected note, None when a deck is selected"""
+        item = self.currentItem()
+        kind = item.data(0, USER_ROLE) if item else None
+        return kind[1] if kind and kind[0] == 'note' else None
+
+    def on_item_double_clicked(self, item, column):
+        """Emit a note's row dict, or load the next page of notes"""
+        kind = item.data(0, USER_ROLE)
+        if not kind:
+            return
+        if kind[0] == 'note':
+            self.card_activated.emit(kind[1])
+        elif kind[0] == 'more':
+            parent_item = item.parent()
+            parent_item.removeChild(item)
+            self.load_notes(parent_item, kind[1], kind[2])
@@ -0,0 +1,128 @@
+import re
+import heapq
+import threading
+from array import array
+from collections import Counter
+from anki.utils import ids2str
+
+CJK_RUN = re.compile('[\\u4e00-\\u9fff]+')
+WORD = re.compile('[^\\W_]+')
+
+class FuzzyIndex:
+    """In-memory n-gram index over cleaned note titles for typo-tolerant ranked search"""
+
+    def __init__(self, card_linker, min_similarity=0.5, chunk_size=5000):
+        self.card_linker = card_linker
+        self.min_similarity = min_similarity
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop all index data"""
+        self.checkpoint = None
+        self.dirty = True
+        self.queued_note_ids = set()
+        self.note_ids = array('q')
+        self.card_ids = array('q')
+        self.mods = array('q')
+        self.gram_counts = array('H')
+        self.titles = []
+        self.postings = {}
+        self.positions = {}
+        self.removed = set()
+
+    def make_grams(self, text):
+        """Get n-grams of text - padded trigrams of words, bigrams of CJK runs"""
+        grams = set()
+        text = text.casefold()
+        for run in CJK_RUN.findall(text):
+            if len(run) == 1:
+                grams.add(run)
+            grams.update((run[i:i + 2] for i in range(len(run) - 1)))
+        for word in WORD.findall(CJK_RUN.sub(' ', text)):
+            padded = f'  {word} '
+            grams.update((padded[i:i + 3] for i in range(len(padded) - 2)))
+        return grams
+
+    def add_entry(self, note_id, card_id, mod, raw_field):
+        """Index a note under its first card, hiding any older entry of the same note"""
+        title = self.card_linker.clean_card_title(raw_field)
+        grams = self.make_grams(title[:200])
+        position = len(self.note_ids)
+        if note_id in self.positions:
+            self.removed.add(self.positions[note_id])
+        self.positions[note_id] = position
+        self.note_ids.append(note_id)
+        self.card_ids.append(card_id)
+        self.mods.append(mod)
+        self.gram_counts.append(min(len(grams), 65535))
+        self.titles.append(title[:80])
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('i')
+            posting.append(position)
+
+    def index_notes(self, col, note_ids):
+        """Add entries for the given notes in chunks, skipping notes indexed at the same mod and hiding notes that no longer exist"""
+        for start in range(0, len(note_ids), self.chunk_size):
+            chunk = note_ids[start:start + self.chunk_size]
+            found = set()
+            for note_id, card_id, mod, flds in col.db.all(f'select n.id, min(c.id), n.mod, n.flds from notes n join cards c on c.nid = n.id where n.id in {ids2str(chunk)} group by n.id'):
+                found.add(note_id)
+                position = self.positions.get(note_id)
+                if position is None or self.mods[position] != mod:
+                    self.add_entry(note_id, card_id, mod, flds.split('\x1f')[0])
+            for note_id in chunk:
+                if note_id not in found and note_id in self.positions:
+                    self.removed.add(self.positions.pop(note_id))
+
+    def mark_dirty(self):
+        """Note that notes may have changed, so the next search re-checks the collection"""
+        self.dirty = True
+
+    def queue_notes(self, note_ids):
+        """Queue notes to re-check on the next refresh whatever their mod, e.g. after an undo"""
+        self.queued_note_ids.update(note_ids)
+
+    def refresh(self, col):
+        """Build index on first use, afterwards re-index only notes modified or synced since the last refresh, once marked dirty"""
+        if self.checkpoint is not None and not self.dirty and not self.queued_note_ids:
+            return
+        self.dirty = False
+        new_checkpoint = self.card_linker.get_change_checkpoint(col)
+        note_ids = self.card_linker.get_changed_ids(col, self.checkpoint) if self.checkpoint is not None else None
+        if note_ids is None or len(self.removed) > len(self.note_ids) // 4:
+            self.reset()
+            self.index_notes(col, col.db.list('select id from notes'))
+        else:
+            queued_note_ids = self.queued_note_ids
+            self.queued_note_ids = set()
+            self.index_notes(col, list(queued_note_ids.union(note_ids)))
+        self.checkpoint = new_checkpoint
+
+    def search(self, col, query, limit):
+        """Get result rows ranked by share of query n-grams matched, then by overall similarity"""
+        with self.lock:
+            self.refresh(col)
+            query_grams = self.make_grams(self.card_linker.clean_card_title(query))
+            if not query_grams:
+                return []
+            hits = Counter()
+            for gram in query_grams:
+                posting = self.postings.get(gram)
+                if posting:
+                    hits.update(posting)
+            scored = []
+            for position, count in hits.items():
+                coverage = count / len(query_grams)
+                if coverage < self.min_similarity or position in self.removed:
+                    continue
+                scored.append((coverage, count / (len(query_grams) + self.gram_counts[position] - count), position))
+            best = [(self.card_ids[position], self.note_ids[position], self.titles[position]) for coverage, similarity, position in heapq.nlargest(limit, scored)]
+        if not best:
+            return []
+        card_decks = dict(col.db.all(f'select id, did from cards where id in {ids2str([row[0] for row in best])}'))
+        deck_names = self.card_linker.deck_cache.get_names(col)
+        return [{'id': card_id, 'note_id': note_id, 'question': title, 'deck': deck_names.get(card_decks[card_id], '')} for card_id, note_id, title in best if card_id in card_decks]
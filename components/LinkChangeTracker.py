@@ -0,0 +1,107 @@
+from aqt import mw
+from aqt.qt import QTimer
+from aqt.operations import QueryOp
+from anki.utils import ids2str
+
+class LinkChangeTracker:
+    """Keep the link index, graph and search indexes in sync with notes changed outside the link dialog"""
+
+    def __init__(self, card_linker, delay=500):
+        self.card_linker = card_linker
+        self.delay = delay
+        self.scheduled = False
+        self.running = False
+        self.check_deleted = False
+        self.session_note_ids = set()
+        self.undone_note_ids = set()
+
+    def open(self):
+        """Catch up with changes since the stored checkpoint, rebuilding only when it is missing"""
+        self.session_note_ids = set()
+        self.undone_note_ids = set()
+        link_index = self.card_linker.link_index
+        if link_index.get_checkpoint() is None:
+            link_index.rebuild(on_done=self.catch_up)
+        else:
+            self.catch_up()
+
+    def schedule(self, check_deleted=False):
+        """Catch up shortly and mark the fuzzy index dirty, coalescing bursts of note changes - safe to call from background ops"""
+        self.check_deleted = self.check_deleted or check_deleted
+        self.card_linker.fuzzy_index.mark_dirty()
+        if self.scheduled:
+            return
+        self.scheduled = True
+        mw.taskman.run_on_main(lambda: QTimer.singleShot(self.delay, self.run_scheduled))
+
+    def run_scheduled(self):
+        self.scheduled = False
+        if self.running or self.card_linker.link_index.building:
+            self.schedule()
+            return
+        self.catch_up()
+
+    def record_notes(self, note_ids):
+        """Remember notes changed or deleted this session, the only ones an undo can restore"""
+        self.session_note_ids.update(note_ids)
+
+    def requeue_after_undo(self):
+        """Re-index every note changed this session, as undo restores their older mod and usn below the checkpoints"""
+        note_ids = set(self.session_note_ids)
+        self.undone_note_ids.update(note_ids)
+        self.card_linker.search_index.queue_notes(note_ids)
+        self.card_linker.fuzzy_index.queue_notes(note_ids)
+        self.card_linker.link_suggester.queue_notes(note_ids)
+        self.schedule()
+
+    def catch_up(self):
+        """Re-parse LinkedCards of notes modified or synced since the checkpoint and apply the deltas, and catch up the search and suggestion indexes"""
+        link_index = self.card_linker.link_index
+        if mw.col is None or link_index.db is None or link_index.building:
+            return
+        self.card_linker.search_index.catch_up(self.check_deleted)
+        self.card_linker.link_suggester.catch_up(self.check_deleted)
+        checkpoint = link_index.get_checkpoint()
+        if checkpoint is None:
+            link_index.rebuild(on_done=self.catch_up)
+            return
+        source_note_ids = link_index.get_source_note_ids() if self.check_deleted else []
+        self.check_deleted = False
+        undone_note_ids = self.undone_note_ids
+        self.undone_note_ids = set()
+        self.running = True
+
+        def op(col):
+            new_checkpoint = self.card_linker.get_change_checkpoint(col)
+            note_ids = self.card_linker.get_changed_ids(col, checkpoint)
+            if note_ids is None:
+                return None
+            note_ids = set(note_ids) | undone_note_ids
+            changed = list(self.card_linker.iter_linked_cards_fields(list(note_ids), include_empty=True)) if note_ids else []
+            deleted = self.find_deleted_note_ids(col, list(undone_note_ids.union(source_note_ids)))
+            return (new_checkpoint, note_ids, changed, deleted)
+
+        def on_success(result):
+            self.running = False
+            if result is None:
+                link_index.rebuild(on_done=self.catch_up)
+                return
+            new_checkpoint, note_ids, changed, deleted = result
+            self.record_notes(note_ids)
+            for note_id, field_content in changed:
+                self.card_linker.apply_link_changes(note_id, self.card_linker.parse_link_ids(field_content))
+            if deleted:
+                self.card_linker.remove_link_data(deleted)
+            if link_index.db is not None:
+                link_index.set_checkpoint(new_checkpoint)
+
+        def on_failure(e):
+            self.running = False
+        QueryOp(parent=mw, op=op, success=on_success).failure(on_failure).run_in_background()
+
+    def find_deleted_note_ids(self, col, note_ids):
+        """Get the given note ids that no longer exist, e.g. after a sync or an undo removed them"""
+        existing = set()
+        for start in range(0, len(note_ids), 5000):
+            existing.update(col.db.list(f'select id from notes where id in {ids2str(note_ids[start:start + 5000])}'))
+        return [note_id for note_id in note_ids if note_id not in existing]
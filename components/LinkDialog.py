@@ -1,8 +1,17 @@
 from ..lang import get_text
+from ..addon_config import get_config
 from aqt import mw
 from aqt.qt import *
+from aqt.operations import QueryOp, CollectionOp
 from aqt.utils import showInfo
 from anki.notes import Note
+from .CardListModel import SearchResultsModel, SelectedCardsModel
+from .DeckTreePicker import DeckTreePicker
+
+try:
+    DIALOG_ACCEPTED = QDialog.DialogCode.Accepted
+except:
+    DIALOG_ACCEPTED = QDialog.Accepted
 
 class LinkDialog(QDialog):
 
@@ -11,7 +20,15 @@ class LinkDialog(QDialog):
         self.editor = editor
         self.card_linker = card_linker
         self.current_note = editor.note
-        self.selected_cards = []
+        self.selected_model = SelectedCardsModel(self)
+        self.search_model = SearchResultsModel(self.card_linker.hydrate_search_results, self.selected_model, self.current_note.id, parent=self)
+        self.suggested_model = SearchResultsModel(self.card_linker.hydrate_search_results, self.selected_model, self.current_note.id, parent=self)
+        self.search_generation = 0
+        self.search_running = False
+        self.closed = False
+        self.original_links = self.card_linker.get_linked_cards(self.current_note)
+        self.removed_card_ids = set()
+        self.card_linker.search_candidates.clear()
         self.setup_ui()
 
     def setup_ui(self):
@@ -22,23 +39,53 @@ class LinkDialog(QDialog):
         top_layout = QHBoxLayout()
         search_group = QGroupBox(get_text('search_cards_group'))
         search_layout = QVBoxLayout()
+        search_tab = QWidget()
+        search_tab_layout = QVBoxLayout()
+        search_tab_layout.setContentsMargins(0, 0, 0, 0)
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText(get_text('search_placeholder'))
-        self.search_input.textChanged.connect(self.search_cards)
-        search_layout.addWidget(self.search_input)
-        self.search_results = QListWidget()
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(get_config('search_debounce_ms', 250))
+        self.search_timer.timeout.connect(self.search_cards)
+        self.search_input.textChanged.connect(self.on_search_text_changed)
+        self.search_mode = QComboBox()
+        self.search_mode.addItem(get_text('search_mode_standard'), 'standard')
+        self.search_mode.addItem(get_text('search_mode_fuzzy'), 'fuzzy')
+        self.search_mode.setToolTip(get_text('search_mode_tip'))
+        self.search_mode.setCurrentIndex(max(self.search_mode.findData(get_config('default_search_mode', 'standard')), 0))
+        self.search_mode.currentIndexChanged.connect(self.search_cards)
+        search_input_layout = QHBoxLayout()
+        search_input_layout.addWidget(self.search_input)
+        search_input_layout.addWidget(self.search_mode)
+        search_tab_layout.addLayout(search_input_layout)
+        self.search_results = QListView()
+        self.search_results.setModel(self.search_model)
+        self.search_results.setUniformItemSizes(True)
         self.search_results.setMaximumHeight(200)
-        self.search_results.itemDoubleClicked.connect(self.on_item_double_clicked)
-        search_layout.addWidget(self.search_results)
+        self.search_results.doubleClicked.connect(self.on_item_double_clicked)
+        search_tab_layout.addWidget(self.search_results)
+        search_tab.setLayout(search_tab_layout)
+        self.deck_tree = DeckTreePicker(self.card_linker, self.current_note.id, parent=self)
+        self.deck_tree.setMaximumHeight(230)
+        self.deck_tree.card_activated.connect(self.add_card_to_selection)
+        self.source_tabs = QTabWidget()
+        self.source_tabs.addTab(search_tab, get_text('search_tab'))
+        self.source_tabs.addTab(self.deck_tree, get_text('browse_decks_tab'))
+        search_layout.addWidget(self.source_tabs)
         add_selected_btn = QPushButton(get_text('add_selected_card'))
         add_selected_btn.clicked.connect(self.on_add_button_clicked)
         add_selected_btn.setStyleSheet('background-color: #4CAF50; color: white; padding: 6px;')
         search_layout.addWidget(add_selected_btn)
         search_group.setLayout(search_layout)
         top_layout.addWidget(search_group)
+        if get_config('link_suggestions', True):
+            top_layout.addWidget(self.setup_suggested_group())
         selected_group = QGroupBox(get_text('selected_cards_group'))
         selected_layout = QVBoxLayout()
-        self.selected_cards_list = QListWidget()
+        self.selected_cards_list = QListView()
+        self.selected_cards_list.setModel(self.selected_model)
+        self.selected_cards_list.setUniformItemSizes(True)
         self.selected_cards_list.setMaximumHeight(200)
         selected_layout.addWidget(self.selected_cards_list)
         selected_buttons_layout = QHBoxLayout()
@@ -72,6 +119,10 @@ class LinkDialog(QDialog):
         layout.addWidget(self.status_label)
         button_layout = QHBoxLayout()
         button_layout.addStretch()
+        cancel_btn = QPushButton(get_text('cancel_button'))
+        cancel_btn.clicked.connect(self.reject)
+        cancel_btn.setStyleSheet('padding: 8px;')
+        button_layout.addWidget(cancel_btn)
         close_btn = QPushButton(get_text('close_dialog'))
         close_btn.clicked.connect(self.accept)
         close_btn.setStyleSheet('background-color: #2196F3; color: white; font-weight: bold; padding: 8px;')
@@ -79,97 +130,200 @@ class LinkDialog(QDialog):
         layout.addLayout(button_layout)
         self.setLayout(layout)
         self.load_existing_links()
+        if get_config('link_suggestions', True):
+            self.load_suggestions()
+
+    def setup_suggested_group(self):
+        """Setup pane listing cards similar to the current note"""
+        suggested_group = QGroupBox(get_text('suggested_cards_group'))
+        suggested_layout = QVBoxLayout()
+        self.suggested_label = QLabel(get_text('suggestions_loading'))
+        self.suggested_label.setStyleSheet('color: #666; font-size: 12px;')
+        suggested_layout.addWidget(self.suggested_label)
+        self.suggested_list = QListView()
+        self.suggested_list.setModel(self.suggested_model)
+        self.suggested_list.setUniformItemSizes(True)
+        self.suggested_list.setMaximumHeight(200)
+        self.suggested_list.doubleClicked.connect(self.on_suggested_double_clicked)
+        suggested_layout.addWidget(self.suggested_list)
+        suggested_group.setLayout(suggested_layout)
+        return suggested_group
+
+    def load_suggestions(self):
+        """Rank notes by similarity to the current note from the sidecar index, then look up their cards in a short collection op"""
+        suggester = self.card_linker.link_suggester
+        if not suggester.is_ready():
+            self.suggested_label.setText(get_text('suggestions_building'))
+            return
+        text = ' '.join((value for name, value in self.current_note.items() if name != self.card_linker.linked_cards_field))
+        note_id = self.current_note.id
+        limit = get_config('suggestion_count', 10)
+
+        def on_success(cards):
+            if self.closed:
+                return
+            self.suggested_model.set_results(cards)
+            if cards:
+                self.suggested_label.hide()
+            else:
+                self.suggested_label.setText(get_text('suggestions_none'))
+
+        def on_failure(e):
+            if not self.closed:
+                self.suggested_label.setText(get_text('suggestions_none'))
+
+        def on_scored(note_ids):
+            if self.closed:
+                return
+            if not note_ids:
+                on_success([])
+                return
+            QueryOp(parent=self, op=lambda col: suggester.get_results(col, note_ids, note_id, limit), success=on_success).failure(on_failure).run_in_background()
+        op = QueryOp(parent=self, op=lambda col: suggester.score(text, limit + 50), success=on_scored).failure(on_failure)
+        if hasattr(op, 'without_collection'):
+            op = op.without_collection()
+        op.run_in_background()
+
+    def on_suggested_double_clicked(self, index):
+        """Link a suggested card"""
+        self.add_card_to_selection(self.suggested_model.card_at(index.row()))
 
     def load_existing_links(self):
         """Load existing links to display list"""
         try:
             linked_cards = self.card_linker.get_linked_cards(self.current_note)
+            selected_cards = []
             for link in linked_cards:
                 try:
                     card = mw.col.getCard(link['card_id'])
                     if card:
                         selected_card = {'id': link['card_id'], 'note_id': link['note_id'], 'title': link['title'], 'deck': link['deck'], 'display_text': link['title'][:40] + '...' if len(link['title']) > 40 else link['title']}
-                        self.selected_cards.append(selected_card)
+                        selected_cards.append(selected_card)
                 except:
                     continue
-            self.update_selected_cards_display()
+            self.selected_model.set_cards(selected_cards)
             self.update_status()
         except:
             pass
 
+    def on_search_text_changed(self):
+        """Restart debounce window on each keystroke"""
+        self.search_timer.start()
+
     def search_cards(self):
-        """Search cards"""
+        """Search cards in background, superseding any earlier search"""
+        self.search_timer.stop()
+        self.search_generation += 1
         query = self.search_input.text().strip()
         if not query:
-            self.search_results.clear()
+            self.search_model.clear()
             return
-        self.search_results.clear()
-        cards = self.card_linker.search_cards(query)
-        for card_info in cards:
-            if card_info['note_id'] == self.current_note.id:
-                continue
-            already_selected = any((selected['id'] == card_info['id'] for selected in self.selected_cards))
-            item_text = f"{card_info['question']} ({get_text('deck_label')}: {card_info['deck']})"
-            if already_selected:
-                item_text = f'✅ {item_text}'
-            item = QListWidgetItem(item_text)
-            item.setData(USER_ROLE, card_info)
-            if already_selected:
-                item.setBackground(QColor(200, 255, 200))
-            self.search_results.addItem(item)
-
-    def on_item_double_clicked(self, item):
+        if not self.search_running:
+            self.start_search(self.search_generation, query, self.search_mode.currentData())
+
+    def start_search(self, generation, query, mode):
+        """Run one search op, showing results only if no newer search was requested meanwhile"""
+        self.search_running = True
+
+        def on_success(result):
+            self.search_running = False
+            if self.closed:
+                return
+            if generation == self.search_generation:
+                self.search_model.set_results(*result)
+                return
+            latest_query = self.search_input.text().strip()
+            if latest_query:
+                self.start_search(self.search_generation, latest_query, self.search_mode.currentData())
+
+        def on_failure(e):
+            self.search_running = False
+            if not self.closed and generation != self.search_generation:
+                self.search_cards()
+        QueryOp(parent=self, op=lambda col: self.card_linker.search(query, mode), success=on_success).failure(on_failure).run_in_background()
+
+    def on_item_double_clicked(self, index):
         """Handle double-click event"""
-        self.add_card_to_selection(item)
+        self.add_card_to_selection(self.search_model.card_at(index.row()))
 
     def on_add_button_clicked(self):
         """Handle add button click event"""
-        current_item = self.search_results.currentItem()
-        if not current_item:
+        if self.source_tabs.currentWidget() is self.deck_tree:
+            card_info = self.deck_tree.current_card()
+        else:
+            card_info = self.search_model.card_at(self.search_results.currentIndex().row())
+        if not card_info:
             showInfo(get_text('error_select_card_first'))
             return
-        self.add_card_to_selection(current_item)
+        self.add_card_to_selection(card_info)
 
-    def add_card_to_selection(self, item):
-        """添加卡片并立即创建链接"""
-        if not item:
-            return
-        card_info = item.data(USER_ROLE)
+    def add_card_to_selection(self, card_info):
+        """添加卡片，关闭对话框时保存链接"""
         if not card_info:
             return
-        if any((selected['id'] == card_info['id'] for selected in self.selected_cards)):
+        if card_info['id'] in self.selected_model.card_ids:
             showInfo(get_text('error_card_already_added'))
             return
-        raw_title = card_info['question']
-        clean_title = self.clean_card_title(raw_title)
-        link_text = clean_title[:50]
-        success = self.card_linker.add_link_to_note(self.current_note, card_info['id'], link_text)
-        if success:
-            selected_card = {'id': card_info['id'], 'note_id': card_info['note_id'], 'title': link_text, 'deck': card_info['deck'], 'display_text': clean_title[:40] + '...' if len(clean_title) > 40 else clean_title}
-            self.selected_cards.append(selected_card)
-            self.update_selected_cards_display()
+        clean_title = card_info.get('title') or self.clean_card_title(card_info['question'])
+        self.stage_card({'id': card_info['id'], 'note_id': card_info['note_id'], 'title': clean_title[:50], 'deck': card_info['deck'], 'display_text': clean_title[:40] + '...' if len(clean_title) > 40 else clean_title})
+        self.status_label.setText(get_text('status_link_added').format(clean_title[:30]))
+        self.status_label.setStyleSheet('background-color: #e8f5e8; padding: 8px; border-radius: 4px; color: #2e7d32;')
+
+    def stage_card(self, selected_card):
+        """Add a card to the staged links"""
+        self.removed_card_ids.discard(selected_card['id'])
+        self.selected_model.append_card(selected_card)
+        self.search_model.refresh_rows()
+        self.suggested_model.refresh_rows()
+
+    def get_staged_links(self):
+        """Get link list with staged removals and additions applied, None when nothing changed"""
+        original_ids = {link['card_id'] for link in self.original_links}
+        links = [link for link in self.original_links if link['card_id'] not in self.removed_card_ids]
+        links.extend(({'card_id': card['id'], 'note_id': card['note_id'], 'title': card['title'], 'deck': card['deck']} for card in self.selected_model.cards if card['id'] not in original_ids))
+        if len(links) == len(self.original_links) and not self.removed_card_ids & original_ids:
+            return None
+        return links
+
+    def accept(self):
+        """Save staged link edits, then close"""
+        links = self.get_staged_links()
+        if links is not None:
+            self.commit_links(links)
+        super().accept()
+
+    def commit_links(self, links):
+        """Write staged links to the note as one undoable operation and reload the editor"""
+        note = self.current_note
+        editor = self.editor
+        note[self.card_linker.linked_cards_field] = self.card_linker.encode_linked_cards(links)
+
+        def reload_editor(changes=None):
+            self.card_linker.update_link_data(note)
             try:
-                self.editor.loadNote()
+                editor.loadNote()
             except:
                 pass
-            self.status_label.setText(get_text('status_link_added').format(clean_title[:30]))
-            self.status_label.setStyleSheet('background-color: #e8f5e8; padding: 8px; border-radius: 4px; color: #2e7d32;')
-            self.search_cards()
-        else:
-            showInfo(get_text('error_link_creation_failed'))
+        if not note.id:
+            reload_editor()
+            return
 
-    def update_selected_cards_display(self):
-        """Update selected cards display"""
-        self.selected_cards_list.clear()
-        for i, card in enumerate(self.selected_cards):
-            item_text = f"{i + 1}. {card['display_text']} ({card['deck']})"
-            item = QListWidgetItem(item_text)
-            item.setData(USER_ROLE, card)
-            self.selected_cards_list.addItem(item)
+        def op(col):
+            undo_entry = col.add_custom_undo_entry(get_text('link_edit_undo'))
+            col.update_note(note)
+            return col.merge_undo_entries(undo_entry)
+        CollectionOp(parent=mw, op=op).success(reload_editor).failure(lambda e: showInfo(get_text('save_failed').format(str(e)))).run_in_background()
+
+    def done(self, result):
+        """Discard in-flight searches when the dialog closes"""
+        self.closed = True
+        self.deck_tree.closed = True
+        self.search_timer.stop()
+        super().done(result)
 
     def update_status(self):
         """Update status display"""
-        count = len(self.selected_cards)
+        count = len(self.selected_model.cards)
         if count == 0:
             self.status_label.setText(get_text('status_select_cards'))
             self.status_label.setStyleSheet('background-color: #e3f2fd; padding: 8px; border-radius: 4px; color: #1976d2;')
@@ -179,57 +333,35 @@ class LinkDialog(QDialog):
 
     def remove_selected_card(self):
         """Remove selected card and delete link"""
-        current_item = self.selected_cards_list.currentItem()
-        if not current_item:
+        card_info = self.selected_model.card_at(self.selected_cards_list.currentIndex().row())
+        if not card_info:
             showInfo(get_text('error_select_card_to_remove'))
             return
-        card_info = current_item.data(USER_ROLE)
-        if card_info:
-            linked_cards = self.card_linker.get_linked_cards(self.current_note)
-            linked_cards = [link for link in linked_cards if link['card_id'] != card_info['id']]
-            success = self.card_linker.save_linked_cards(self.current_note, linked_cards)
-            if success:
-                self.selected_cards = [card for card in self.selected_cards if card['id'] != card_info['id']]
-                self.update_selected_cards_display()
-                self.update_status()
-                try:
-                    self.editor.loadNote()
-                except:
-                    pass
-                self.search_cards()
-                self.status_label.setText(get_text('status_link_removed').format(card_info['display_text']))
-                self.status_label.setStyleSheet('background-color: #fff3cd; padding: 8px; border-radius: 4px; color: #856404;')
-            else:
-                showInfo(get_text('error_remove_link_failed'))
+        self.removed_card_ids.add(card_info['id'])
+        self.selected_model.remove_card(card_info['id'])
+        self.search_model.refresh_rows()
+        self.suggested_model.refresh_rows()
+        self.update_status()
+        self.status_label.setText(get_text('status_link_removed').format(card_info['display_text']))
+        self.status_label.setStyleSheet('background-color: #fff3cd; padding: 8px; border-radius: 4px; color: #856404;')
 
     def clear_all_selections(self):
         """Clear all links"""
-        if not self.selected_cards:
+        if not self.selected_model.cards:
             return
         from aqt.utils import askUser
         if askUser(get_text('confirm_clear_all_links')):
-            success = self.card_linker.save_linked_cards(self.current_note, [])
-            if success:
-                self.selected_cards.clear()
-                self.update_selected_cards_display()
-                self.update_status()
-                try:
-                    self.editor.loadNote()
-                except:
-                    pass
-                self.search_cards()
-                self.status_label.setText(get_text('status_all_links_cleared'))
-                self.status_label.setStyleSheet('background-color: #fff3cd; padding: 8px; border-radius: 4px; color: #856404;')
-            else:
-                showInfo(get_text('error_clear_links_failed'))
+            self.removed_card_ids.update((link['card_id'] for link in self.original_links))
+            self.selected_model.set_cards([])
+            self.search_model.refresh_rows()
+            self.suggested_model.refresh_rows()
+            self.update_status()
+            self.status_label.setText(get_text('status_all_links_cleared'))
+            self.status_label.setStyleSheet('background-color: #fff3cd; padding: 8px; border-radius: 4px; color: #856404;')
 
     def clean_card_title(self, title):
         """Clean card title, remove HTML tags and special characters"""
-        import re
-        clean_title = re.sub('<[^>]+>', '', title)
-        clean_title = re.sub('\\s+', ' ', clean_title).strip()
-        clean_title = re.sub('[^\\w\\s\\u4e00-\\u9fff.,!?;:()\\-\\[\\]{}"]', '', clean_title)
-        return clean_title
+        return self.card_linker.clean_card_title(title)
 
     def open_add_cards_dialog(self):
         """Open simple add card dialog"""
@@ -243,25 +375,17 @@ class LinkDialog(QDialog):
                 self.auto_add_created_card(dialog.created_card_id, dialog.created_card_title)
 
     def auto_add_created_card(self, card_id, card_title):
-        """Automatically add newly created card as link"""
+        """Automatically stage newly created card as link"""
         try:
             clean_title = self.clean_card_title(card_title)
-            link_text = clean_title[:50]
-            success = self.card_linker.add_link_to_note(self.current_note, card_id, link_text)
-            if success:
-                card = mw.col.getCard(card_id)
-                deck_name = mw.col.decks.name(card.did)
-                selected_card = {'id': card_id, 'note_id': card.note().id, 'title': link_text, 'deck': deck_name, 'display_text': clean_title[:40] + '...' if len(clean_title) > 40 else clean_title}
-                self.selected_cards.append(selected_card)
-                self.update_selected_cards_display()
-                try:
-                    self.editor.loadNote()
-                except:
-                    pass
-                self.status_label.setText(get_text('success_new_card_linked').format(clean_title[:30]))
-                self.status_label.setStyleSheet('background-color: #e8f5e8; padding: 8px; border-radius: 4px; color: #2e7d32;')
-            else:
+            card = mw.col.getCard(card_id)
+            if not card:
                 showInfo(get_text('error_new_card_link_failed'))
+                return
+            deck_name = self.card_linker.deck_cache.name(card.did)
+            self.stage_card({'id': card_id, 'note_id': card.nid, 'title': clean_title[:50], 'deck': deck_name, 'display_text': clean_title[:40] + '...' if len(clean_title) > 40 else clean_title})
+            self.status_label.setText(get_text('success_new_card_linked').format(clean_title[:30]))
+            self.status_label.setStyleSheet('background-color: #e8f5e8; padding: 8px; border-radius: 4px; color: #2e7d32;')
         except Exception as e:
             showInfo(get_text('error_add_link_failed').format(str(e)))
 
@@ -0,0 +1,199 @@
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+from aqt import mw
+from anki.utils import ids2str
+
+class LinkGraph:
+    """In-memory note link graph stored as CSR arrays, built on first query, with an overlay for incremental changes"""
+
+    def __init__(self, card_linker, compact_threshold=512):
+        self.card_linker = card_linker
+        self.compact_threshold = compact_threshold
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.building = False
+        self.reset()
+
+    def reset(self):
+        """Drop all graph data, it is rebuilt on the next query"""
+        with self.lock:
+            self.built = False
+            self.node_ids = array('q')
+            self.offsets = array('i', [0])
+            self.targets = array('i')
+            self.rev_offsets = array('i', [0])
+            self.rev_sources = array('i')
+            self.overrides = {}
+            self.removed = set()
+
+    def ensure_built(self, col=None):
+        """Build graph from one bulk read of the notes table unless already built - run in background, edits made meanwhile stay in the overlay"""
+        if self.built:
+            return
+        with self.build_lock:
+            if self.built:
+                return
+            self.building = True
+            try:
+                arrays = self.build_arrays(self.scan_edges(col or mw.col))
+                with self.lock:
+                    self.node_ids, self.offsets, self.targets, self.rev_offsets, self.rev_sources = arrays
+                    self.built = True
+            finally:
+                self.building = False
+
+    def scan_edges(self, col):
+        """Get sorted unique (source note id, target note id) pairs for every link in the collection"""
+        card_links = []
+        for note_id, field_content in self.card_linker.iter_linked_cards_fields():
+            for card_id in self.card_linker.parse_link_ids(field_content):
+                if isinstance(card_id, int):
+                    card_links.append((note_id, card_id))
+        card_notes = self.load_card_notes(col, {card_id for note_id, card_id in card_links})
+        return sorted({(note_id, card_notes[card_id]) for note_id, card_id in card_links if card_id in card_notes and card_notes[card_id] != note_id})
+
+    def load_card_notes(self, col, card_ids):
+        """Get {card id: note id} with chunked queries"""
+        card_notes = {}
+        card_ids = list(card_ids)
+        for start in range(0, len(card_ids), 5000):
+            card_notes.update(col.db.all(f'select id, nid from cards where id in {ids2str(card_ids[start:start + 5000])}'))
+        return card_notes
+
+    def build_arrays(self, edges):
+        """Pack sorted note id edges into node, forward and reverse CSR arrays"""
+        nodes = sorted({note_id for edge in edges for note_id in edge})
+        positions = {note_id: i for i, note_id in enumerate(nodes)}
+        forward = [(positions[src], positions[dst]) for src, dst in edges]
+        reverse = sorted(((dst, src) for src, dst in forward))
+        offsets, targets = self.pack(forward, len(nodes))
+        rev_offsets, rev_sources = self.pack(reverse, len(nodes))
+        return (array('q', nodes), offsets, targets, rev_offsets, rev_sources)
+
+    def pack(self, pairs, node_count):
+        """Pack (row, column) pairs sorted by row into offset and column arrays"""
+        offsets = array('i', [0]) * (node_count + 1)
+        for row, column in pairs:
+            offsets[row + 1] += 1
+        for i in range(node_count):
+            offsets[i + 1] += offsets[i]
+        return (offsets, array('i', (column for row, column in pairs)))
+
+    def position(self, note_id):
+        """Get array position of a note, -1 when it has no stored edges"""
+        i = bisect_left(self.node_ids, note_id)
+        if i < len(self.node_ids) and self.node_ids[i] == note_id:
+            return i
+        return -1
+
+    def neighbors(self, note_id):
+        """Get ids of notes the given note links to"""
+        self.ensure_built()
+        with self.lock:
+            return self.get_neighbors(note_id)
+
+    def backlinks(self, note_id):
+        """Get ids of notes linking to the given note"""
+        self.ensure_built()
+        with self.lock:
+            return self.get_backlinks(note_id)
+
+    def get_neighbors(self, note_id):
+        """Get ids of notes the given note links to, with the lock held"""
+        if note_id in self.overrides:
+            targets = self.overrides[note_id]
+        else:
+            i = self.position(note_id)
+            if i < 0:
+                return ()
+            targets = tuple((self.node_ids[j] for j in self.targets[self.offsets[i]:self.offsets[i + 1]]))
+        if self.removed:
+            return tuple((target for target in targets if target not in self.removed))
+        return targets
+
+    def get_backlinks(self, note_id):
+        """Get ids of notes linking to the given note, with the lock held"""
+        if note_id in self.removed:
+            return ()
+        sources = []
+        i = self.position(note_id)
+        if i >= 0:
+            for j in self.rev_sources[self.rev_offsets[i]:self.rev_offsets[i + 1]]:
+                if self.node_ids[j] not in self.overrides:
+                    sources.append(self.node_ids[j])
+        sources.extend((source for source, targets in self.overrides.items() if note_id in targets))
+        return tuple(sources)
+
+    def linked_note_ids(self, note_id):
+        """Get ids of notes linked with the given note in either direction"""
+        return set(self.neighbors(note_id)).union(self.backlinks(note_id))
+
+    def degree(self, note_id):
+        """Get number of outgoing plus incoming links"""
+        return len(self.neighbors(note_id)) + len(self.backlinks(note_id))
+
+    def component(self, note_id, limit=10000):
+        """Get ids of notes connected to the given note in either direction"""
+        seen = {note_id}
+        queue = deque([note_id])
+        while queue and len(seen) < limit:
+            current = queue.popleft()
+            for other in self.neighbors(current) + self.backlinks(current):
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+        return seen
+
+    def shortest_path(self, source_id, target_id, max_depth=6):
+        """Get note ids on a shortest undirected path, empty when none within max_depth"""
+        if source_id == target_id:
+            return [source_id]
+        parents = {source_id: None}
+        frontier = [source_id]
+        for depth in range(max_depth):
+            next_frontier = []
+            for current in frontier:
+                for other in self.neighbors(current) + self.backlinks(current):
+                    if other in parents:
+                        continue
+                    parents[other] = current
+                    if other == target_id:
+                        path = [other]
+                        while parents[path[-1]] is not None:
+                            path.append(parents[path[-1]])
+                        return path[::-1]
+                    next_frontier.append(other)
+            frontier = next_frontier
+        return []
+
+    def update_links(self, note_id, card_ids):
+        """Replace outgoing edges of a single note, skipped until the graph is first built"""
+        if not note_id or not (self.built or self.building):
+            return
+        card_notes = self.load_card_notes(mw.col, [card_id for card_id in card_ids if isinstance(card_id, int)])
+        with self.lock:
+            self.overrides[note_id] = tuple(sorted({target for target in card_notes.values() if target != note_id}))
+            self.removed.discard(note_id)
+            self.compact_if_needed()
+
+    def remove_notes(self, note_ids):
+        """Drop deleted notes and their edges, skipped until the graph is first built"""
+        if not (self.built or self.building):
+            return
+        with self.lock:
+            for note_id in note_ids:
+                self.overrides[note_id] = ()
+                self.removed.add(note_id)
+            self.compact_if_needed()
+
+    def compact_if_needed(self):
+        """Fold the overlay back into the arrays once it grows large, with the lock held"""
+        if self.building or len(self.overrides) < self.compact_threshold:
+            return
+        nodes = set(self.overrides).union(self.node_ids)
+        edges = sorted({(source, target) for source in nodes for target in self.get_neighbors(source)})
+        self.node_ids, self.offsets, self.targets, self.rev_offsets, self.rev_sources = self.build_arrays(edges)
+        self.overrides = {}
+        self.removed = set()
@@ -0,0 +1,130 @@
+from aqt import mw
+from aqt.operations import QueryOp
+from anki.utils import ids2str
+from .SidecarDatabase import parse_checkpoint, format_checkpoint
+
+class LinkIndex:
+    """Reverse link index mapping source note id to linked card id"""
+
+    def __init__(self, card_linker, sidecar):
+        self.card_linker = card_linker
+        self.sidecar = sidecar
+        self.building = False
+        self.listeners = []
+
+    @property
+    def db(self):
+        return self.sidecar.db
+
+    def open(self):
+        """Create index tables"""
+        self.db.execute('create table if not exists links (src_nid integer not null, dst_cid integer not null, primary key (src_nid, dst_cid)) without rowid')
+        self.db.execute('create index if not exists ix_links_dst on links (dst_cid, src_nid)')
+        self.db.commit()
+
+    def is_ready(self):
+        """Check if index can be queried"""
+        return self.db is not None and not self.building and self.get_checkpoint() is not None
+
+    def get_checkpoint(self):
+        """Get (note mod, note usn) up to which the index is known to be current, None before first build"""
+        return parse_checkpoint(self.sidecar.get_meta('links_checkpoint'))
+
+    def set_checkpoint(self, checkpoint):
+        """Record (note mod, note usn) the index is current up to"""
+        self.sidecar.set_meta('links_checkpoint', format_checkpoint(checkpoint))
+        self.db.commit()
+
+    def rebuild(self, on_done=None):
+        """Rebuild whole index from one bulk read of the notes table, writing it on a separate connection off the main thread"""
+        if self.building:
+            return
+        self.building = True
+
+        def op(col):
+            checkpoint = self.card_linker.get_change_checkpoint(col)
+            rows = list(self.scan_links())
+            db = self.sidecar.connect()
+            try:
+                db.execute('delete from links')
+                db.executemany('insert or ignore into links (src_nid, dst_cid) values (?, ?)', rows)
+                db.execute("insert or replace into meta (key, value) values ('links_checkpoint', ?)", (format_checkpoint(checkpoint),))
+                db.commit()
+            finally:
+                db.close()
+
+        def on_success(result):
+            self.building = False
+            if self.db is None:
+                return
+            self.notify(None)
+            if on_done:
+                on_done()
+
+        def on_failure(e):
+            self.building = False
+        QueryOp(parent=mw, op=op, success=on_success).failure(on_failure).run_in_background()
+
+    def scan_links(self):
+        """Yield (source note id, card id) for every link in the collection"""
+        for note_id, field_content in self.card_linker.iter_linked_cards_fields():
+            for card_id in self.card_linker.parse_link_ids(field_content):
+                try:
+                    yield (note_id, int(card_id))
+                except (TypeError, ValueError):
+                    continue
+
+    def update_links(self, note_id, card_ids):
+        """Replace index rows of a single source note"""
+        if self.db is None or not note_id:
+            return
+        new_card_ids = set()
+        for card_id in card_ids:
+            try:
+                new_card_ids.add(int(card_id))
+            except (TypeError, ValueError):
+                continue
+        old_card_ids = {row[0] for row in self.db.execute('select dst_cid from links where src_nid = ?', (note_id,))}
+        if old_card_ids == new_card_ids:
+            return
+        self.db.execute('delete from links where src_nid = ?', (note_id,))
+        self.db.executemany('insert into links (src_nid, dst_cid) values (?, ?)', [(note_id, card_id) for card_id in new_card_ids])
+        self.db.commit()
+        self.notify(old_card_ids ^ new_card_ids)
+
+    def remove_notes(self, note_ids):
+        """Drop index rows of deleted source notes"""
+        if self.db is None or not note_ids:
+            return
+        card_ids = {row[0] for row in self.db.execute(f'select dst_cid from links where src_nid in {ids2str(note_ids)}')}
+        self.db.execute(f'delete from links where src_nid in {ids2str(note_ids)}')
+        self.db.commit()
+        self.notify(card_ids)
+
+    def notify(self, card_ids):
+        """Tell listeners which target cards gained or lost backlinks, None meaning all"""
+        if card_ids is not None and not card_ids:
+            return
+        for listener in self.listeners:
+            try:
+                listener(card_ids)
+            except:
+                pass
+
+    def get_backlinks(self, card_ids):
+        """Get ids of notes linking to any of the given cards"""
+        if self.db is None or not card_ids:
+            return []
+        return [row[0] for row in self.db.execute(f'select distinct src_nid from links where dst_cid in {ids2str(card_ids)}')]
+
+    def get_source_note_ids(self):
+        """Get every note id that has index rows"""
+        if self.db is None:
+            return []
+        return [row[0] for row in self.db.execute('select distinct src_nid from links')]
+
+    def get_linked_card_ids(self):
+        """Get every card id referenced by at least one link"""
+        if self.db is None:
+            return []
+        return [row[0] for row in self.db.execute('select distinct dst_cid from links')]
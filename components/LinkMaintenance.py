@@ -0,0 +1,190 @@
+from aqt import mw
+from aqt.operations import CollectionOp, QueryOp
+from aqt.utils import showInfo, askUser
+from anki.collection import OpChanges
+from anki.utils import ids2str
+import json
+from ..lang import get_text
+from ..addon_config import get_config
+
+class LinkMaintenance:
+    """Collection-wide maintenance jobs for stored links"""
+
+    def __init__(self, card_linker, chunk_size=500):
+        self.card_linker = card_linker
+        self.chunk_size = chunk_size
+        self.deleted_card_ids = set()
+        self.deleted_note_ids = set()
+
+    def migrate_to_compact(self):
+        """Rewrite every legacy LinkedCards field in the compact v2 format"""
+        result = {'count': 0}
+
+        def op(col):
+            updates = []
+            for note_id, field_content in self.card_linker.iter_linked_cards_fields():
+                try:
+                    version, data = self.card_linker.decode_linked_cards(field_content)
+                    if version == 1:
+                        updates.append((note_id, self.card_linker.encode_linked_cards(data, compact=True)))
+                except:
+                    continue
+            result['count'] = len(updates)
+            return self.write_fields(col, updates, get_text('migrate_links_undo'))
+        CollectionOp(parent=mw, op=op).success(lambda changes: showInfo(get_text('migrate_links_done').format(result['count']))).with_progress(get_text('migrate_links_progress')).run_in_background()
+
+    def refresh_link_details(self):
+        """Recompute stored titles and deck names of legacy-format links, rewriting only changed notes"""
+        result = {'count': 0}
+
+        def op(col):
+            legacy_notes = []
+            for note_id, field_content in self.card_linker.iter_linked_cards_fields():
+                try:
+                    version, data = self.card_linker.decode_linked_cards(field_content)
+                except:
+                    continue
+                if version == 1 and data:
+                    legacy_notes.append((note_id, data))
+            card_ids = {link.card_id for note_id, data in legacy_notes for link in data if isinstance(link.card_id, int)}
+            details = self.load_card_details(col, card_ids)
+            updates = []
+            for note_id, data in legacy_notes:
+                links = []
+                for link in data:
+                    detail = details.get(link.card_id)
+                    if detail and (link.title, link.deck, link.note_id) != detail:
+                        link = link._replace(title=detail[0], deck=detail[1], note_id=detail[2])
+                    links.append(link)
+                if links != list(data):
+                    updates.append((note_id, self.card_linker.encode_linked_cards(links, compact=False)))
+            result['count'] = len(updates)
+            return self.write_fields(col, updates, get_text('refresh_links_undo'))
+        CollectionOp(parent=mw, op=op).success(lambda changes: showInfo(get_text('refresh_links_done').format(result['count']))).with_progress(get_text('refresh_links_progress')).run_in_background()
+
+    def load_card_details(self, col, card_ids):
+        """Get {card id: (title, deck name, note id)} with chunked joined queries and cached deck names"""
+        deck_names = self.card_linker.deck_cache.get_names(col)
+        details = {}
+        card_ids = list(card_ids)
+        for start in range(0, len(card_ids), 5000):
+            chunk = card_ids[start:start + 5000]
+            rows = col.db.all(f'select c.id, c.nid, c.did, n.mod, n.flds from cards c join notes n on n.id = c.nid where c.id in {ids2str(chunk)}')
+            titles = self.card_linker.get_link_titles([(note_id, mod, flds) for card_id, note_id, deck_id, mod, flds in rows])
+            for (card_id, note_id, deck_id, mod, flds), title in zip(rows, titles):
+                details[card_id] = (title, deck_names.get(deck_id, ''), note_id)
+        return details
+
+    def check_dangling_links(self):
+        """Report links whose target card no longer exists and offer to prune them"""
+
+        def on_success(dangling):
+            if not dangling:
+                showInfo(get_text('dangling_links_none'))
+                return
+            link_count = sum((len(card_ids) for card_ids in dangling.values()))
+            if askUser(get_text('dangling_links_found').format(link_count, len(dangling))):
+                self.prune_links(dangling)
+        QueryOp(parent=mw, op=self.find_dangling_links, success=on_success).with_progress(get_text('dangling_links_progress')).run_in_background()
+
+    def find_dangling_links(self, col):
+        """Get {note id: set of missing card ids} for every note with links to deleted cards"""
+        links = {}
+        for note_id, field_content in self.card_linker.iter_linked_cards_fields():
+            card_ids = {card_id for card_id in self.card_linker.parse_link_ids(field_content) if isinstance(card_id, int)}
+            if card_ids:
+                links[note_id] = card_ids
+        missing = self.find_missing_card_ids(col, set().union(*links.values()))
+        dangling = {}
+        for note_id, card_ids in links.items():
+            if not card_ids.isdisjoint(missing):
+                dangling[note_id] = card_ids & missing
+        return dangling
+
+    def find_missing_card_ids(self, col, card_ids):
+        """Get referenced card ids that are not in the cards table, using one anti-join"""
+        if not card_ids:
+            return set()
+        try:
+            return set(col.db.list('select j.value from json_each(?) j left join cards c on c.id = j.value where c.id is null', json.dumps(list(card_ids))))
+        except:
+            existing = set()
+            card_ids = list(card_ids)
+            for start in range(0, len(card_ids), 5000):
+                existing.update(col.db.list(f'select id from cards where id in {ids2str(card_ids[start:start + 5000])}'))
+            return set(card_ids) - existing
+
+    def prune_links(self, dangling):
+        """Remove dangling links in chunked writes as one undo step"""
+        result = {'count': 0}
+
+        def op(col):
+            updates = []
+            for note_id, field_content in self.card_linker.iter_linked_cards_fields(list(dangling)):
+                field_content = self.remove_link_ids(field_content, dangling[note_id])
+                if field_content is not None:
+                    updates.append((note_id, field_content))
+            result['count'] = len(updates)
+            return self.write_fields(col, updates, get_text('prune_links_undo'))
+        CollectionOp(parent=mw, op=op).success(lambda changes: showInfo(get_text('prune_links_done').format(result['count']))).with_progress(get_text('prune_links_progress')).run_in_background()
+
+    def prune_links_to_deleted_notes(self, col, note_ids):
+        """Remember cards of notes about to be deleted, their links are pruned once the deletion has finished"""
+        if not get_config('auto_prune_dangling_links', False):
+            return
+        self.deleted_card_ids.update(col.db.list(f'select id from cards where nid in {ids2str(note_ids)}'))
+        self.deleted_note_ids.update(note_ids)
+
+    def prune_deleted_card_links(self):
+        """Unlink remembered cards of deleted notes from every note that links to them, as an undo step of its own"""
+        link_index = self.card_linker.link_index
+        if not self.deleted_card_ids or not link_index.is_ready():
+            return
+        card_ids, note_ids = (self.deleted_card_ids, self.deleted_note_ids)
+        self.deleted_card_ids, self.deleted_note_ids = (set(), set())
+        source_ids = set(link_index.get_backlinks(card_ids)) - note_ids
+        if not source_ids:
+            return
+
+        def op(col):
+            updates = []
+            for note_id, field_content in self.card_linker.iter_linked_cards_fields(list(source_ids)):
+                field_content = self.remove_link_ids(field_content, card_ids)
+                if field_content is not None:
+                    updates.append((note_id, field_content))
+            return self.write_fields(col, updates, get_text('prune_links_undo'))
+        CollectionOp(parent=mw, op=op).run_in_background()
+
+    def remove_link_ids(self, field_content, card_ids):
+        """Get field content without links to the given cards, None when nothing was removed"""
+        try:
+            version, data = self.card_linker.decode_linked_cards(field_content)
+        except:
+            return None
+        if version == 1:
+            kept = [link for link in data if link.card_id not in card_ids]
+        else:
+            kept = [{'card_id': card_id} for card_id in data if card_id not in card_ids]
+        if len(kept) == len(data):
+            return None
+        return self.card_linker.encode_linked_cards(kept, compact=version != 1)
+
+    def write_fields(self, col, updates, undo_label):
+        """Write (note id, LinkedCards content) pairs in chunks as a single undo step"""
+        if not updates:
+            return OpChanges()
+        undo_entry = col.add_custom_undo_entry(undo_label)
+        total = len(updates)
+        for start in range(0, total, self.chunk_size):
+            notes = []
+            for note_id, field_content in updates[start:start + self.chunk_size]:
+                note = col.get_note(note_id)
+                note[self.card_linker.linked_cards_field] = field_content
+                notes.append(note)
+            col.update_notes(notes)
+            self.report_progress(min(start + self.chunk_size, total), total)
+        return col.merge_undo_entries(undo_entry)
+
+    def report_progress(self, done, total):
+        """Update progress dialog from a background op"""
+        mw.taskman.run_on_main(lambda: mw.progress.update(label=get_text('maintenance_progress').format(done, total), value=done, max=total))
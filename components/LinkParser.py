@@ -0,0 +1,84 @@
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from aqt import mw
+from ..lang import get_text
+
+try:
+    import orjson
+    fast_loads = orjson.loads
+except ImportError:
+    fast_loads = None
+
+class LinkRecord(namedtuple('LinkRecord', ['card_id', 'note_id', 'title', 'deck'])):
+    """Immutable parsed link, readable by attribute or like the legacy link dict"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        """Get legacy link dict for v1 storage"""
+        return dict(self._asdict())
+
+class LinkParser:
+    """Memoized LinkedCards decoder with an optional fast JSON backend"""
+
+    def __init__(self, max_size=2048, loads=None):
+        self.max_size = max_size
+        self.loads = loads or fast_loads or json.loads
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.error_count = 0
+        self.last_error = None
+
+    def decode(self, field_content):
+        """Decode raw field into (format version, tuple) - v1 holds LinkRecords, v2 card ids"""
+        field_content = field_content or '[]'
+        with self.lock:
+            result = self.cache.get(field_content)
+            if result is not None:
+                self.cache.move_to_end(field_content)
+        if result is None:
+            try:
+                result = self.parse(field_content)
+            except Exception as e:
+                self.record_error(e)
+                result = (None, str(e))
+            with self.lock:
+                self.cache[field_content] = result
+                while len(self.cache) > self.max_size:
+                    self.cache.popitem(last=False)
+        if result[0] is None:
+            raise ValueError(result[1])
+        return result
+
+    def parse(self, field_content):
+        """Parse raw field without caching"""
+        data = self.loads(field_content)
+        if isinstance(data, dict):
+            return (data.get('v', 2), tuple((int(card_id) for card_id in data.get('c', []))))
+        return (1, tuple((LinkRecord(link.get('card_id'), link.get('note_id'), link.get('title', ''), link.get('deck', '')) for link in data)))
+
+    def record_error(self, error):
+        """Count a field that failed to parse and tell the user about the first one of the session"""
+        self.error_count += 1
+        self.last_error = str(error)
+        print(get_text('link_parse_error').format(self.error_count, self.last_error))
+        if self.error_count == 1:
+            from aqt.utils import tooltip
+            mw.taskman.run_on_main(lambda: tooltip(get_text('link_parse_error').format(self.error_count, self.last_error)))
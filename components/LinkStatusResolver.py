@@ -0,0 +1,44 @@
+from aqt import mw
+from anki.utils import ids2str
+
+class LinkStatusResolver:
+    """Resolve existence, queue, deck and review status of linked cards in bulk"""
+
+    def __init__(self):
+        self.reviewed_card_ids = None
+        self.day_cutoff = None
+
+    def resolve(self, card_ids):
+        """Return {card_id: status} for every existing card, using set-based queries"""
+        ids = []
+        for card_id in card_ids:
+            try:
+                ids.append(int(card_id))
+            except (TypeError, ValueError):
+                continue
+        statuses = {}
+        if not ids:
+            return statuses
+        reviewed_card_ids = self.get_reviewed_card_ids()
+        for card_id, queue, deck_id in mw.col.db.all(f'select id, queue, did from cards where id in {ids2str(set(ids))}'):
+            statuses[card_id] = {'card_id': card_id, 'queue': queue, 'did': deck_id, 'reviewed': card_id in reviewed_card_ids}
+        return statuses
+
+    def get_reviewed_card_ids(self):
+        """Get ids of cards reviewed since the scheduler's current day started"""
+        day_cutoff = mw.col.sched.day_cutoff
+        if self.reviewed_card_ids is None or day_cutoff != self.day_cutoff:
+            today_start = day_cutoff - 86400
+            self.reviewed_card_ids = set(mw.col.db.list('select distinct cid from revlog where id > ? and ease > 0', today_start * 1000))
+            self.day_cutoff = day_cutoff
+        return self.reviewed_card_ids
+
+    def mark_reviewed(self, card_id):
+        """Record a card answered in the reviewer"""
+        if self.reviewed_card_ids is not None:
+            self.reviewed_card_ids.add(card_id)
+
+    def reset(self):
+        """Forget reviewed cards, they are reloaded from the revlog on next use"""
+        self.reviewed_card_ids = None
+        self.day_cutoff = None
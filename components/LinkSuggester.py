@@ -0,0 +1,261 @@
+import math
+from collections import Counter
+from aqt import mw
+from aqt.operations import QueryOp
+from anki.utils import ids2str
+from ..addon_config import get_config
+from .FuzzyIndex import CJK_RUN, WORD
+from .SidecarDatabase import parse_checkpoint, format_checkpoint
+
+SCHEMA_VERSION = '2'
+
+class LinkSuggester:
+    """TF-IDF similarity between notes for suggesting link targets, with an inverted index in the sidecar database"""
+
+    def __init__(self, card_linker, sidecar, chunk_size=500, max_query_terms=64):
+        self.card_linker = card_linker
+        self.sidecar = sidecar
+        self.chunk_size = chunk_size
+        self.max_query_terms = max_query_terms
+        self.generation = 0
+        self.reset()
+
+    @property
+    def db(self):
+        return self.sidecar.db
+
+    def reset(self):
+        """Stop using the index, chunks of a catch-up still queued are dropped"""
+        self.generation += 1
+        self.available = False
+        self.running = False
+        self.pending = False
+        self.pending_check_deleted = False
+        self.deleted_note_ids = set()
+        self.queued_note_ids = set()
+
+    def open(self):
+        """Create index tables when suggestions are enabled, dropping tables of an older layout"""
+        self.reset()
+        if not get_config('link_suggestions', True):
+            return
+        if self.sidecar.get_meta('suggest_version') != SCHEMA_VERSION:
+            for table in ('suggest_postings', 'suggest_docs', 'suggest_terms'):
+                self.db.execute(f'drop table if exists {table}')
+            self.db.execute("delete from meta where key in ('suggest_checkpoint', 'suggest_norms_docs')")
+            self.sidecar.set_meta('suggest_version', SCHEMA_VERSION)
+        self.db.execute('create table if not exists suggest_terms (id integer primary key, term text not null unique, df integer not null default 0, idf real not null default 1)')
+        self.db.execute('create table if not exists suggest_docs (nid integer primary key, mod integer not null, norm real not null)')
+        self.db.execute('create table if not exists suggest_postings (term_id integer not null, nid integer not null, weight real not null, primary key (term_id, nid)) without rowid')
+        self.db.execute('create index if not exists ix_suggest_postings_nid on suggest_postings (nid)')
+        self.db.commit()
+        self.available = True
+
+    def is_ready(self):
+        """Check if index has been built and can be queried"""
+        return self.available and self.db is not None and self.sidecar.get_meta('suggest_checkpoint') is not None
+
+    def tokenize(self, text):
+        """Get term counts of cleaned text - words of two or more letters and CJK bigrams"""
+        text = self.card_linker.clean_card_title_for_search(text).casefold()
+        tokens = [word for word in WORD.findall(CJK_RUN.sub(' ', text)) if len(word) > 1 and not word.isdigit()]
+        for run in CJK_RUN.findall(text):
+            if len(run) == 1:
+                tokens.append(run)
+            tokens.extend((run[i:i + 2] for i in range(len(run) - 1)))
+        return Counter(tokens)
+
+    def idf(self, df, doc_count):
+        """Get smoothed inverse document frequency of a term"""
+        return math.log((doc_count + 1) / (df + 1)) + 1
+
+    def lookup_terms(self, db, terms):
+        """Get {term: (term id, df)} for the given terms known to the index"""
+        terms = list(terms)
+        found = {}
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            for term, term_id, df in db.execute(f"select term, id, df from suggest_terms where term in ({', '.join('?' * len(chunk))})", chunk):
+                found[term] = (term_id, df)
+        return found
+
+    def remove_notes(self, note_ids):
+        """Queue deleted notes for removal on the next catch-up - called from the delete op's thread, so only queue here"""
+        if self.available:
+            self.deleted_note_ids.update(note_ids)
+
+    def queue_notes(self, note_ids):
+        """Queue notes to re-index on the next catch-up whatever their mod, e.g. after an undo"""
+        if self.available:
+            self.queued_note_ids.update(note_ids)
+
+    def catch_up(self, check_deleted=False):
+        """Index notes changed since the stored checkpoint in background, one chunk per op so other collection ops run in between"""
+        if not self.available or self.db is None or mw.col is None:
+            return
+        if self.running:
+            self.pending = True
+            self.pending_check_deleted = self.pending_check_deleted or check_deleted
+            return
+        self.running = True
+        generation = self.generation
+        deleted_note_ids = self.deleted_note_ids
+        self.deleted_note_ids = set()
+        queued_note_ids = self.queued_note_ids
+        self.queued_note_ids = set()
+
+        def on_done(result=None):
+            if generation != self.generation:
+                return
+            self.running = False
+            if self.pending:
+                check_deleted = self.pending_check_deleted
+                self.pending = False
+                self.pending_check_deleted = False
+                self.catch_up(check_deleted)
+            elif self.is_ready() and not self.card_linker.link_graph.built:
+                QueryOp(parent=mw, op=lambda col: self.card_linker.link_graph.ensure_built(col), success=lambda result: None).run_in_background()
+
+        def run_chunks(work):
+            if generation != self.generation:
+                return
+            checkpoint, note_ids, deleted_note_ids, full = work
+
+            def next_chunk(result=None):
+                if generation != self.generation:
+                    return
+                if note_ids:
+                    chunk = note_ids[-self.chunk_size:]
+                    del note_ids[-self.chunk_size:]
+                    QueryOp(parent=mw, op=lambda col: self.index_chunk(col, chunk), success=next_chunk).failure(on_done).run_in_background()
+                else:
+                    QueryOp(parent=mw, op=lambda col: self.finish(deleted_note_ids, checkpoint, full), success=on_done).failure(on_done).run_in_background()
+            next_chunk()
+        QueryOp(parent=mw, op=lambda col: self.find_changes(col, deleted_note_ids, queued_note_ids, check_deleted), success=run_chunks).failure(on_done).run_in_background()
+
+    def find_changes(self, col, deleted_note_ids, queued_note_ids, check_deleted):
+        """Get (new checkpoint, note ids to index, deleted note ids, full) - clears the index first when it has to be built from scratch"""
+        db = self.sidecar.connect()
+        try:
+            checkpoint = parse_checkpoint((db.execute("select value from meta where key = 'suggest_checkpoint'").fetchone() or [None])[0])
+            new_checkpoint = self.card_linker.get_change_checkpoint(col)
+            note_ids = self.card_linker.get_changed_ids(col, checkpoint) if checkpoint is not None else None
+            if note_ids is None:
+                db.execute('delete from suggest_postings')
+                db.execute('delete from suggest_docs')
+                db.execute('delete from suggest_terms')
+                db.execute("delete from meta where key in ('suggest_checkpoint', 'suggest_norms_docs')")
+                db.commit()
+                return (new_checkpoint, col.db.list('select id from notes'), set(), True)
+            if check_deleted:
+                indexed = [row[0] for row in db.execute('select nid from suggest_docs')]
+                existing = set()
+                for start in range(0, len(indexed), 5000):
+                    existing.update(col.db.list(f'select id from notes where id in {ids2str(indexed[start:start + 5000])}'))
+                deleted_note_ids = deleted_note_ids.union((note_id for note_id in indexed if note_id not in existing))
+            return (new_checkpoint, list(queued_note_ids.union(note_ids) - deleted_note_ids), deleted_note_ids, False)
+        finally:
+            db.close()
+
+    def index_chunk(self, col, note_ids):
+        """Re-tokenize the given notes not yet indexed at their mod, without their LinkedCards field, dropping notes that no longer exist"""
+        ords = self.card_linker.get_linked_field_ords()
+        db = self.sidecar.connect()
+        try:
+            mods = dict(db.execute(f'select nid, mod from suggest_docs where nid in {ids2str(note_ids)}'))
+            docs = []
+            found = set()
+            for note_id, model_id, mod, flds in col.db.all(f'select id, mid, mod, flds from notes where id in {ids2str(note_ids)}'):
+                found.add(note_id)
+                if mods.get(note_id) == mod:
+                    continue
+                skip = ords.get(model_id)
+                text = ' '.join((field for i, field in enumerate(flds.split('\x1f')) if i != skip))
+                docs.append((note_id, mod, self.tokenize(text)))
+            self.remove_docs(db, [note_id for note_id in mods if note_id not in found] + [note_id for note_id, mod, counts in docs if note_id in mods])
+            self.add_docs(db, docs)
+            db.commit()
+        finally:
+            db.close()
+
+    def add_docs(self, db, docs):
+        """Insert postings, document frequencies and vector lengths of new note vectors with sublinear tf weights"""
+        terms = {term for note_id, mod, counts in docs for term in counts}
+        db.executemany('insert or ignore into suggest_terms (term) values (?)', ((term,) for term in terms))
+        known = self.lookup_terms(db, terms)
+        added = Counter((term for note_id, mod, counts in docs for term in counts))
+        db.executemany('update suggest_terms set df = df + ? where id = ?', ((count, known[term][0]) for term, count in added.items()))
+        doc_count = db.execute('select count() from suggest_docs').fetchone()[0] + len(docs)
+        postings = []
+        rows = []
+        for note_id, mod, counts in docs:
+            total = 0.0
+            for term, count in counts.items():
+                term_id, df = known[term]
+                weight = 1 + math.log(count)
+                total += (weight * self.idf(df + added[term], doc_count)) ** 2
+                postings.append((term_id, note_id, weight))
+            rows.append((note_id, mod, math.sqrt(total) or 1))
+        db.executemany('insert into suggest_postings (term_id, nid, weight) values (?, ?, ?)', postings)
+        db.executemany('insert or replace into suggest_docs (nid, mod, norm) values (?, ?, ?)', rows)
+
+    def remove_docs(self, db, note_ids):
+        """Delete postings and vector rows of the given notes and drop them from the document frequencies"""
+        for start in range(0, len(note_ids), self.chunk_size):
+            chunk = ids2str(note_ids[start:start + self.chunk_size])
+            db.execute(f'update suggest_terms set df = df - (select count() from suggest_postings p where p.term_id = suggest_terms.id and p.nid in {chunk}) where id in (select term_id from suggest_postings where nid in {chunk})')
+            db.execute(f'delete from suggest_postings where nid in {chunk}')
+            db.execute(f'delete from suggest_docs where nid in {chunk}')
+
+    def finish(self, deleted_note_ids, checkpoint, full):
+        """Drop deleted notes, recompute vector lengths after a build or a large change in note count, and store the checkpoint"""
+        db = self.sidecar.connect()
+        try:
+            self.remove_docs(db, list(deleted_note_ids))
+            doc_count = db.execute('select count() from suggest_docs').fetchone()[0]
+            norms_doc_count = int((db.execute("select value from meta where key = 'suggest_norms_docs'").fetchone() or [0])[0])
+            if full or abs(doc_count - norms_doc_count) > norms_doc_count // 10:
+                self.rebuild_norms(db, doc_count)
+            db.execute("insert or replace into meta (key, value) values ('suggest_checkpoint', ?)", (format_checkpoint(checkpoint),))
+            db.commit()
+        finally:
+            db.close()
+
+    def rebuild_norms(self, db, doc_count):
+        """Recompute stored idf and every vector length with the current document frequencies, summing postings in SQL"""
+        db.execute('delete from suggest_terms where df <= 0')
+        db.executemany('update suggest_terms set idf = ? where id = ?', [(self.idf(df, doc_count), term_id) for term_id, df in db.execute('select id, df from suggest_terms').fetchall()])
+        norms = db.execute('select p.nid, sum(p.weight * p.weight * t.idf * t.idf) from suggest_postings p join suggest_terms t on t.id = p.term_id group by p.nid').fetchall()
+        db.executemany('update suggest_docs set norm = ? where nid = ?', [(math.sqrt(total) or 1, note_id) for note_id, total in norms])
+        db.execute("insert or replace into meta (key, value) values ('suggest_norms_docs', ?)", (str(doc_count),))
+
+    def score(self, text, limit):
+        """Get ids of the notes most similar to the given text, best first, by cosine similarity summed over postings in SQL - reads only the sidecar"""
+        counts = self.tokenize(text)
+        if not counts:
+            return []
+        db = self.sidecar.connect()
+        try:
+            doc_count = db.execute('select count() from suggest_docs').fetchone()[0]
+            query = []
+            for term, (term_id, df) in self.lookup_terms(db, counts).items():
+                idf = self.idf(df, doc_count)
+                query.append(((1 + math.log(counts[term])) * idf, term_id, idf))
+            query = sorted(query, reverse=True)[:self.max_query_terms]
+            if not query:
+                return []
+            values = ', '.join(['(?, ?)'] * len(query))
+            params = [value for weight, term_id, idf in query for value in (term_id, weight * idf)]
+            return [row[0] for row in db.execute(f'with q (term_id, factor) as (values {values}) select p.nid from q join suggest_postings p on p.term_id = q.term_id group by p.nid order by sum(p.weight * q.factor) / (select norm from suggest_docs d where d.nid = p.nid) desc limit ?', params + [limit])]
+        finally:
+            db.close()
+
+    def get_results(self, col, note_ids, note_id, limit):
+        """Get result rows for scored notes in order, skipping the given note and notes already linked with it either way"""
+        skipped = self.card_linker.link_graph.linked_note_ids(note_id) if note_id else set()
+        skipped.add(note_id)
+        note_ids = [other for other in note_ids if other not in skipped]
+        if not note_ids:
+            return []
+        first_cards = dict(col.db.all(f'select nid, min(id) from cards where nid in {ids2str(note_ids)} group by nid'))
+        return self.card_linker.hydrate_search_results([first_cards[other] for other in note_ids if other in first_cards][:limit])
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+class PanelCache:
+    """Bounded LRU cache of rendered linked-cards panels"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.keys_by_card = {}
+        self.version = 0
+
+    def make_key(self, note, field_content, day_cutoff, language):
+        """Build cache key from note version, link data, scheduler day and language"""
+        return (note.id, note.mod, hash(field_content), day_cutoff, language)
+
+    def get(self, key):
+        """Get cached panel html, or None on a miss"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, panel_html, card_ids):
+        """Store rendered panel together with the card ids it shows status for"""
+        self.remove(key)
+        card_ids = frozenset(card_ids)
+        self.entries[key] = (panel_html, card_ids)
+        for card_id in card_ids:
+            self.keys_by_card.setdefault(card_id, set()).add(key)
+        while len(self.entries) > self.max_size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """Remove single entry"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for card_id in entry[1]:
+            keys = self.keys_by_card.get(card_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_card[card_id]
+
+    def invalidate_cards(self, card_ids):
+        """Drop every panel that displays one of the given cards"""
+        self.version += 1
+        for card_id in card_ids:
+            for key in list(self.keys_by_card.get(card_id, ())):
+                self.remove(key)
+
+    def invalidate_note(self, note_id):
+        """Drop every panel rendered for the given note"""
+        self.version += 1
+        for key in [key for key in self.entries if key[0] == note_id]:
+            self.remove(key)
+
+    def clear(self):
+        """Drop all panels"""
+        self.version += 1
+        self.entries.clear()
+        self.keys_by_card.clear()
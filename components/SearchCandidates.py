@@ -0,0 +1,34 @@
+from .SearchIndex import SEARCH_SYNTAX
+
+class SearchCandidates:
+    """Candidate set of the last plain-text search, narrowed in memory while the query keeps growing"""
+
+    def __init__(self, max_size=2000):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        """Forget the last candidate set"""
+        self.query = None
+        self.entries = []
+        self.texts = []
+
+    def store(self, query, entries):
+        """Remember complete (untruncated) search entries with their raw fields for later refinement"""
+        if SEARCH_SYNTAX.search(query) or len(entries) > self.max_size:
+            self.clear()
+            return
+        self.query = query
+        self.entries = entries
+        self.texts = [entry[4].casefold() for entry in entries]
+
+    def refine(self, query):
+        """Get entries matching a query that strictly extends the last one, None when a full search is needed"""
+        if self.query is None or len(query) <= len(self.query) or not query.startswith(self.query) or SEARCH_SYNTAX.search(query):
+            return None
+        terms = query.casefold().split()
+        kept = [i for i, text in enumerate(self.texts) if all((term in text for term in terms))]
+        self.query = query
+        self.entries = [self.entries[i] for i in kept]
+        self.texts = [self.texts[i] for i in kept]
+        return self.entries
@@ -0,0 +1,156 @@
+import re
+import sqlite3
+from aqt import mw
+from aqt.operations import QueryOp
+from anki.utils import ids2str
+from ..addon_config import get_config
+from .SidecarDatabase import parse_checkpoint, format_checkpoint
+
+SEARCH_SYNTAX = re.compile('[:"*_()]|(^|\\s)-')
+
+class SearchIndex:
+    """Optional FTS5 index of card titles, tags and deck names in the sidecar database"""
+
+    def __init__(self, card_linker, sidecar, chunk_size=2000):
+        self.card_linker = card_linker
+        self.sidecar = sidecar
+        self.chunk_size = chunk_size
+        self.available = False
+        self.running = False
+        self.pending = False
+        self.pending_check_deleted = False
+        self.deleted_note_ids = set()
+        self.changed_note_ids = set()
+
+    @property
+    def db(self):
+        return self.sidecar.db
+
+    def open(self):
+        """Create index tables when enabled and FTS5 is available"""
+        self.available = False
+        self.deleted_note_ids = set()
+        self.changed_note_ids = set()
+        if not get_config('fts_search_index', False):
+            return
+        try:
+            self.db.execute("create virtual table if not exists search_fts using fts5(title, tags, deck, tokenize = 'unicode61 remove_diacritics 2')")
+            self.db.execute('create table if not exists search_cards (cid integer primary key, nid integer not null, did integer not null)')
+            self.db.execute('create index if not exists ix_search_cards_nid on search_cards (nid)')
+            self.db.execute('create index if not exists ix_search_cards_did on search_cards (did)')
+            self.db.execute('create table if not exists search_decks (did integer primary key, name text not null)')
+            self.db.commit()
+            self.available = True
+        except sqlite3.OperationalError as e:
+            print(f'Full-text search index unavailable: {e}')
+
+    def is_ready(self):
+        """Check if index has been built and can be queried"""
+        return self.available and self.db is not None and self.sidecar.get_meta('search_notes_checkpoint') is not None
+
+    def search(self, query, limit):
+        """Get ranked result rows for a plain-text query, None when the query needs Anki's search engine"""
+        if SEARCH_SYNTAX.search(query) or not self.is_ready():
+            return None
+        match = ' '.join((f'"{term}"*' for term in query.replace('"', ' ').split()))
+        if not match:
+            return None
+        rows = self.db.execute('select f.rowid, c.nid, f.title, f.deck from search_fts f join search_cards c on c.cid = f.rowid where search_fts match ? order by bm25(search_fts, 10.0, 2.0, 1.0) limit ?', (match, limit)).fetchall()
+        return [{'id': card_id, 'note_id': note_id, 'question': title[:80], 'deck': deck} for card_id, note_id, title, deck in rows]
+
+    def remove_notes(self, note_ids):
+        """Queue deleted notes for removal on the next catch-up - called from the delete op's thread, so only queue here"""
+        if self.available:
+            self.deleted_note_ids.update(note_ids)
+
+    def queue_notes(self, note_ids):
+        """Queue notes to re-index on the next catch-up whatever their mod, e.g. after an undo"""
+        if self.available:
+            self.changed_note_ids.update(note_ids)
+
+    def catch_up(self, check_deleted=False):
+        """Index cards changed since the stored checkpoints in background, building from scratch when missing"""
+        if not self.available or self.db is None or mw.col is None:
+            return
+        if self.running:
+            self.pending = True
+            self.pending_check_deleted = self.pending_check_deleted or check_deleted
+            return
+        self.running = True
+        deleted_note_ids = self.deleted_note_ids
+        self.deleted_note_ids = set()
+        changed_note_ids = self.changed_note_ids
+        self.changed_note_ids = set()
+
+        def on_done(result=None):
+            self.running = False
+            if self.pending:
+                check_deleted = self.pending_check_deleted
+                self.pending = False
+                self.pending_check_deleted = False
+                self.catch_up(check_deleted)
+        QueryOp(parent=mw, op=lambda col: self.sync(col, deleted_note_ids, changed_note_ids, check_deleted), success=on_done).failure(on_done).run_in_background()
+
+    def sync(self, col, deleted_note_ids, changed_note_ids, check_deleted):
+        """Bring index up to date on a separate connection so bulk writes stay off the main thread"""
+        db = self.sidecar.connect()
+        try:
+            notes_checkpoint = parse_checkpoint((db.execute("select value from meta where key = 'search_notes_checkpoint'").fetchone() or [None])[0])
+            cards_checkpoint = parse_checkpoint((db.execute("select value from meta where key = 'search_cards_checkpoint'").fetchone() or [None])[0])
+            new_notes_checkpoint = self.card_linker.get_change_checkpoint(col)
+            new_cards_checkpoint = self.card_linker.get_change_checkpoint(col, 'cards')
+            deck_names = self.card_linker.deck_cache.get_names(col)
+            note_ids = None
+            if notes_checkpoint is not None and cards_checkpoint is not None:
+                note_ids = self.card_linker.get_changed_ids(col, notes_checkpoint)
+                card_note_ids = self.card_linker.get_changed_ids(col, cards_checkpoint, 'cards', 'nid')
+                if note_ids is not None and card_note_ids is not None:
+                    note_ids = set(note_ids).union(card_note_ids, changed_note_ids)
+                else:
+                    note_ids = None
+            if note_ids is None:
+                db.execute('delete from search_fts')
+                db.execute('delete from search_cards')
+                self.index_notes(db, col, col.db.list('select id from notes'), deck_names)
+            else:
+                if check_deleted:
+                    deleted_note_ids = deleted_note_ids | self.find_deleted_note_ids(db, col)
+                self.remove_note_rows(db, note_ids | deleted_note_ids)
+                self.index_notes(db, col, list(note_ids - deleted_note_ids), deck_names)
+                self.rename_decks(db, deck_names)
+            db.execute('delete from search_decks')
+            db.executemany('insert into search_decks (did, name) values (?, ?)', deck_names.items())
+            db.executemany('insert or replace into meta (key, value) values (?, ?)', [('search_notes_checkpoint', format_checkpoint(new_notes_checkpoint)), ('search_cards_checkpoint', format_checkpoint(new_cards_checkpoint))])
+            db.commit()
+        finally:
+            db.close()
+
+    def index_notes(self, db, col, note_ids, deck_names):
+        """Insert index rows for every card of the given notes in chunks"""
+        for start in range(0, len(note_ids), self.chunk_size):
+            rows = col.db.all(f'select c.id, c.nid, c.did, n.flds, n.tags from cards c join notes n on n.id = c.nid where c.nid in {ids2str(note_ids[start:start + self.chunk_size])}')
+            db.executemany('insert or replace into search_cards (cid, nid, did) values (?, ?, ?)', [(card_id, note_id, deck_id) for card_id, note_id, deck_id, flds, tags in rows])
+            db.executemany('insert into search_fts (rowid, title, tags, deck) values (?, ?, ?, ?)', [(card_id, self.card_linker.clean_card_title_for_search(flds.split('\x1f')[0]), tags.strip(), deck_names.get(deck_id, '')) for card_id, note_id, deck_id, flds, tags in rows])
+
+    def remove_note_rows(self, db, note_ids):
+        """Delete index rows of the given notes"""
+        note_ids = list(note_ids)
+        for start in range(0, len(note_ids), self.chunk_size):
+            chunk = ids2str(note_ids[start:start + self.chunk_size])
+            db.execute(f'delete from search_fts where rowid in (select cid from search_cards where nid in {chunk})')
+            db.execute(f'delete from search_cards where nid in {chunk}')
+
+    def rename_decks(self, db, deck_names):
+        """Rewrite deck column of cards whose deck was renamed since the last catch-up"""
+        for deck_id, name in db.execute('select did, name from search_decks').fetchall():
+            new_name = deck_names.get(deck_id)
+            if new_name is not None and new_name != name:
+                db.execute('update search_fts set deck = ? where rowid in (select cid from search_cards where did = ?)', (new_name, deck_id))
+
+    def find_deleted_note_ids(self, db, col):
+        """Get indexed notes that no longer exist, e.g. after a sync removed them"""
+        note_ids = [row[0] for row in db.execute('select distinct nid from search_cards')]
+        existing = set()
+        for start in range(0, len(note_ids), 5000):
+            existing.update(col.db.list(f'select id from notes where id in {ids2str(note_ids[start:start + 5000])}'))
+        return {note_id for note_id in note_ids if note_id not in existing}
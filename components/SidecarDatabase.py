@@ -0,0 +1,55 @@
+import os
+import sqlite3
+from aqt import mw
+
+def parse_checkpoint(value):
+    """Get (max mod, max usn) from a stored checkpoint, usn None for checkpoints stored before usn was tracked"""
+    if value is None:
+        return None
+    parts = str(value).split()
+    return (int(parts[0]), int(parts[1]) if len(parts) > 1 else None)
+
+def format_checkpoint(checkpoint):
+    """Get stored form of a (max mod, max usn) checkpoint"""
+    return f'{checkpoint[0]} {checkpoint[1]}'
+
+class SidecarDatabase:
+    """Per-profile SQLite database in the add-on's user_files folder for derived link data"""
+
+    def __init__(self):
+        self.db = None
+        self.path = None
+
+    def open(self):
+        """Open database for current profile"""
+        self.close()
+        folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'user_files')
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f'{mw.pm.name}.db')
+        self.db = self.connect()
+        self.db.execute('pragma journal_mode = wal')
+        self.db.execute('create table if not exists meta (key text primary key, value text) without rowid')
+        self.db.commit()
+        return self.db
+
+    def connect(self, timeout=30):
+        """Open another connection to the profile database, for writes off the main thread"""
+        return sqlite3.connect(self.path, check_same_thread=False, timeout=timeout)
+
+    def close(self):
+        """Close database"""
+        if self.db:
+            try:
+                self.db.close()
+            except:
+                pass
+        self.db = None
+
+    def get_meta(self, key, default=None):
+        """Get stored meta value"""
+        row = self.db.execute('select value from meta where key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """Store meta value, committed with the caller's transaction"""
+        self.db.execute('insert or replace into meta (key, value) values (?, ?)', (key, str(value)))
@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from anki.utils import ids2str
+
+class TitleCache:
+    """Cleaned display titles per note, keyed on note id and mod, kept in memory and in the sidecar database"""
+
+    def __init__(self, card_linker, sidecar, max_size=20000):
+        self.card_linker = card_linker
+        self.sidecar = sidecar
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+
+    def open(self):
+        """Create title table and open the own connection titles are read and written on, as lookups run in background ops"""
+        self.clear()
+        self.sidecar.db.execute('create table if not exists titles (nid integer primary key, mod integer not null, title text not null, link_title text not null) without rowid')
+        self.sidecar.db.commit()
+        with self.lock:
+            self.db = self.sidecar.connect(timeout=0.2)
+
+    def clear(self):
+        """Drop in-memory titles and close the title connection"""
+        with self.lock:
+            self.cache.clear()
+            if self.db is not None:
+                try:
+                    self.db.close()
+                except:
+                    pass
+            self.db = None
+
+    def make_titles(self, raw_field):
+        """Get (search title, link title) for a raw first field"""
+        title = self.card_linker.clean_card_title_for_search(raw_field)[:80]
+        return (title, self.card_linker.clean_card_title(title)[:50])
+
+    def get_titles(self, rows):
+        """Get (search title, link title) for (note id, mod, raw first field) rows, cleaning only notes not cached at that mod"""
+        titles = [None] * len(rows)
+        missing = []
+        with self.lock:
+            for i, (note_id, mod, raw_field) in enumerate(rows):
+                entry = self.cache.get(note_id)
+                if entry is not None and entry[0] == mod:
+                    self.cache.move_to_end(note_id)
+                    titles[i] = entry[1:]
+                else:
+                    missing.append(i)
+            if not missing:
+                return titles
+            stored = {}
+            if self.db is not None:
+                try:
+                    for note_id, mod, title, link_title in self.db.execute(f'select nid, mod, title, link_title from titles where nid in {ids2str({rows[i][0] for i in missing})}'):
+                        stored[note_id] = (mod, title, link_title)
+                except Exception as e:
+                    print(f'Title cache read failed: {e}')
+            new_rows = []
+            for i in missing:
+                note_id, mod, raw_field = rows[i]
+                entry = stored.get(note_id)
+                if entry is None or entry[0] != mod:
+                    entry = (mod,) + self.make_titles(raw_field)
+                    new_rows.append((note_id,) + entry)
+                    stored[note_id] = entry
+                self.cache[note_id] = entry
+                self.cache.move_to_end(note_id)
+                titles[i] = entry[1:]
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+            if new_rows and self.db is not None:
+                try:
+                    self.db.executemany('insert or replace into titles (nid, mod, title, link_title) values (?, ?, ?, ?)', new_rows)
+                    self.db.commit()
+                except Exception as e:
+                    self.db.rollback()
+                    print(f'Title cache write failed: {e}')
+        return titles
+
+    def remove_notes(self, note_ids):
+        """Drop titles of deleted notes"""
+        with self.lock:
+            for note_id in note_ids:
+                self.cache.pop(note_id, None)
+            if self.db is not None and note_ids:
+                try:
+                    self.db.execute(f'delete from titles where nid in {ids2str(note_ids)}')
+                    self.db.commit()
+                except Exception as e:
+                    self.db.rollback()
+                    print(f'Title cache write failed: {e}')
@@ -3,6 +3,8 @@
 Multi-language support for Card Linker Plugin
 """
 
+from .addon_config import get_config
+
 # Language definitions
 LANGUAGES = {
     "en": {
@@ -16,6 +18,17 @@ LANGUAGES = {
         "link_text_placeholder": "Leave empty to use card title as default",
         "search_existing_label": "Search Existing Cards:",
         "search_placeholder": "Enter keywords to search...",
+        "search_mode_standard": "Standard",
+        "search_mode_fuzzy": "Fuzzy",
+        "search_mode_tip": "Fuzzy search tolerates typos and ranks cards by title similarity",
+        "suggested_cards_group": "💡 Suggested",
+        "search_tab": "Search",
+        "browse_decks_tab": "Browse decks",
+        "tree_load_more": "Load more...",
+        "link_edit_undo": "Edit Card Links",
+        "suggestions_loading": "Finding related cards...",
+        "suggestions_none": "No related cards found",
+        "suggestions_building": "Related cards will be suggested once the collection has been indexed",
         "create_new_label": "Or Create New Card:",
         "front_placeholder": "Front content...",
         "back_placeholder": "Back content...",
@@ -37,6 +50,7 @@ LANGUAGES = {
         
         # Review interface
         "related_knowledge": "🧠 Related Knowledge Points",
+        "linked_from": "🔙 Linked From",
         "review_status_tip": "💡 Green ✅ means reviewed today, Orange ⏳ means pending review",
         "deck_switch_notice": "📋 Note: Due to Anki's review mechanism, linked cards not in the current review deck cannot be directly reviewed. They will open in preview mode instead.",
         
@@ -91,7 +105,7 @@ LANGUAGES = {
         "create_new_card_info": "Click button to quickly create new card, it will be automatically added as link after creation",
         "create_new_card_btn": "🆕 Create New Card",
         "close_dialog": "✅ Close",
-        "status_select_cards": "Double-click or click add button to select cards, links will be created immediately after selection",
+        "status_select_cards": "Double-click or click add button to select cards, links are saved when you close the dialog",
         "status_links_created": "{} links created",
         "status_link_added": "✅ Link added: {}...",
         "status_link_removed": "✅ Link removed: {}",
@@ -128,6 +142,26 @@ LANGUAGES = {
         "simple_add_card_back_placeholder": "Enter back content...",
         "simple_add_card_create": "Create Card",
 
+        # Maintenance
+        "menu_title": "AnkiNexus",
+        "menu_migrate_links": "Convert Links to Compact Format",
+        "migrate_links_progress": "Converting links...",
+        "migrate_links_done": "{} notes converted to the compact link format",
+        "migrate_links_undo": "Convert Links",
+        "menu_refresh_links": "Refresh Link Titles and Decks",
+        "refresh_links_progress": "Refreshing link titles and decks...",
+        "refresh_links_done": "{} notes updated with current link titles and decks",
+        "refresh_links_undo": "Refresh Links",
+        "menu_check_dangling_links": "Check Links to Deleted Cards",
+        "dangling_links_progress": "Checking links...",
+        "dangling_links_none": "No links to deleted cards found",
+        "dangling_links_found": "Found {} links to deleted cards in {} notes.\n\nRemove them?",
+        "prune_links_progress": "Removing links to deleted cards...",
+        "prune_links_done": "Links to deleted cards removed from {} notes",
+        "prune_links_undo": "Remove Dangling Links",
+        "maintenance_progress": "Processed {} / {} notes",
+        "link_parse_error": "AnkiNexus: {} LinkedCards fields could not be read (latest error: {})",
+
         # Card status in review
         "card_status_deleted": "Deleted",
         "card_status_load_error": "Load Error",
@@ -145,6 +179,17 @@ LANGUAGES = {
         "link_text_placeholder": "留空将使用卡片标题作为默认名称",
         "search_existing_label": "搜索现有卡片:",
         "search_placeholder": "输入关键词搜索...",
+        "search_mode_standard": "标准",
+        "search_mode_fuzzy": "模糊",
+        "search_mode_tip": "模糊搜索可容忍拼写错误，并按标题相似度排序",
+        "suggested_cards_group": "💡 推荐链接",
+        "search_tab": "搜索",
+        "browse_decks_tab": "按牌组浏览",
+        "tree_load_more": "加载更多...",
+        "link_edit_undo": "编辑卡片链接",
+        "suggestions_loading": "正在查找相关卡片...",
+        "suggestions_none": "未找到相关卡片",
+        "suggestions_building": "卡片索引完成后将显示推荐链接",
         "create_new_label": "或创建新卡片:",
         "front_placeholder": "正面内容...",
         "back_placeholder": "背面内容...",
@@ -166,6 +211,7 @@ LANGUAGES = {
         
         # Review interface
         "related_knowledge": "🧠 相关知识点",
+        "linked_from": "🔙 被以下知识点引用",
         "review_status_tip": "💡 绿色✅表示今日已复习，橙色⏳表示待复习",
         "deck_switch_notice": "📋 提示：由于Anki复习机制，链接卡片不属于当前复习牌组时无法直接跳转复习，已更换为预览模式。",
         
@@ -220,7 +266,7 @@ LANGUAGES = {
         "create_new_card_info": "点击按钮快速创建新卡片，创建成功后会自动添加为链接",
         "create_new_card_btn": "🆕 创建新卡片",
         "close_dialog": "✅ 关闭",
-        "status_select_cards": "双击或点击添加按钮来选择卡片，选择后会立即创建链接",
+        "status_select_cards": "双击或点击添加按钮来选择卡片，关闭对话框时保存链接",
         "status_links_created": "已创建 {} 个链接",
         "status_link_added": "✅ 已添加链接: {}...",
         "status_link_removed": "✅ 已移除链接: {}",
@@ -258,9 +304,6 @@ LANGUAGES = {
         "simple_add_card_create": "创建卡片",
 
         # Comments and debug messages
-        "debug_save_link_data": "保存链接数据: {}",
-        "debug_save_success": "成功保存到字段 {}",
-        "debug_save_failed": "保存失败: {}",
         "comment_load_existing_links": "加载已有的链接到显示列表",
         "comment_card_not_exist": "卡片不存在，跳过",
         "comment_load_failed": "如果加载失败，继续正常流程",
@@ -282,6 +325,26 @@ LANGUAGES = {
         "comment_check_card_found": "检查是否找到了卡片并自动触发预览",
         "comment_delay_execution": "延迟1秒执行，确保搜索完成",
 
+        # Maintenance
+        "menu_title": "AnkiNexus",
+        "menu_migrate_links": "将链接转换为紧凑格式",
+        "migrate_links_progress": "正在转换链接...",
+        "migrate_links_done": "已将 {} 条笔记转换为紧凑链接格式",
+        "migrate_links_undo": "转换链接",
+        "menu_refresh_links": "刷新链接标题和牌组",
+        "refresh_links_progress": "正在刷新链接标题和牌组...",
+        "refresh_links_done": "已更新 {} 条笔记的链接标题和牌组",
+        "refresh_links_undo": "刷新链接",
+        "menu_check_dangling_links": "检查指向已删除卡片的链接",
+        "dangling_links_progress": "正在检查链接...",
+        "dangling_links_none": "未发现指向已删除卡片的链接",
+        "dangling_links_found": "在 {1} 条笔记中发现 {0} 个指向已删除卡片的链接。\n\n是否移除？",
+        "prune_links_progress": "正在移除指向已删除卡片的链接...",
+        "prune_links_done": "已从 {} 条笔记中移除指向已删除卡片的链接",
+        "prune_links_undo": "移除失效链接",
+        "maintenance_progress": "已处理 {} / {} 条笔记",
+        "link_parse_error": "AnkiNexus：{} 个 LinkedCards 字段无法读取（最近错误：{}）",
+
         # Card status in review
         "card_status_deleted": "已删除",
         "card_status_load_error": "加载错误",
@@ -295,12 +358,9 @@ def get_language():
         from aqt import mw
 
         # Check user preference first
-        try:
-            config = mw.addonManager.getConfig(__name__)
-            if config and config.get("language") and config.get("language") != "auto":
-                return config["language"]
-        except:
-            pass
+        language = get_config("language", "auto")
+        if language and language != "auto":
+            return language
 
         # Fall back to Anki's language setting
         try:
@@ -1,52 +1,41 @@
 // Card Linker Plugin JavaScript
+// Loaded once per reviewer page, shared by every card shown in it
 
-// Function to display linked cards
-function showLinkedCards(linkedCards) {
-    if (!linkedCards || linkedCards.length === 0) {
-        return '';
-    }
+// Open linked card through Python backend
+function openLinkedCard(cardId, isReviewed) {
+    pycmd(`linked_card:${cardId}:${isReviewed}`);
+}
 
-    let html = '<div class="linked-cards-container">';
-    html += '<div class="linked-cards-title">Related Cards:</div>';
+// Panel pushed by the async review panel mode, applied once its placeholder is shown
+let pendingLinkedCardsPanel = null;
 
-    for (let card of linkedCards) {
-        html += `<a href="#" class="linked-card-item" onclick="openLinkedCard(${card.card_id})">`;
-        html += `${card.title} (${card.deck})`;
-        html += '</a>';
+function applyPendingLinkedCardsPanel() {
+    if (!pendingLinkedCardsPanel) {
+        return false;
     }
-
-    html += '</div>';
-    return html;
-}
-
-// Open linked card
-function openLinkedCard(cardId) {
-    // Open card through Python backend
-    pycmd(`card_linker:open_card:${cardId}`);
+    const placeholder = document.getElementById('linked-cards-panel');
+    if (!placeholder) {
+        return false;
+    }
+    if (placeholder.dataset.token === String(pendingLinkedCardsPanel.token)) {
+        placeholder.innerHTML = pendingLinkedCardsPanel.html;
+    }
+    pendingLinkedCardsPanel = null;
+    return true;
 }
 
-// Add link information when card is displayed
-function addLinkedCardsToCard() {
-    // This function will be called when card is displayed
-    // Get link information from card's LinkedCards field and display
-    const linkedCardsField = document.querySelector('[data-field-name="LinkedCards"]');
-    if (linkedCardsField && linkedCardsField.textContent) {
-        try {
-            const linkedCards = JSON.parse(linkedCardsField.textContent);
-            const cardContent = document.querySelector('.card');
-            if (cardContent && linkedCards.length > 0) {
-                const linkedCardsHtml = showLinkedCards(linkedCards);
-                cardContent.innerHTML += linkedCardsHtml;
-            }
-        } catch (e) {
-            console.log('Error parsing linked cards:', e);
-        }
+// The reviewer resets onShownHook on every question and answer, so the
+// apply step is queued per answer - by the placeholder's own script and
+// here, for a panel that arrives before its answer is in the page
+function queueLinkedCardsPanel() {
+    if (typeof onShownHook !== 'undefined') {
+        onShownHook.push(applyPendingLinkedCardsPanel);
     }
 }
 
-// Execute after page loading is complete
-if (document.readyState === 'loading') {
-    document.addEventListener('DOMContentLoaded', addLinkedCardsToCard);
-} else {
-    addLinkedCardsToCard();
+function fillLinkedCardsPanel(token, html) {
+    pendingLinkedCardsPanel = { token: token, html: html };
+    if (!applyPendingLinkedCardsPanel()) {
+        queueLinkedCardsPanel();
+    }
 }